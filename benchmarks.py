@@ -0,0 +1,227 @@
+"""
+Микробенчмарки движка, базы данных и отрисовки стола
+
+    python benchmarks.py --save-baseline bench_baseline.json   # запомнить текущие цифры
+    python benchmarks.py --baseline bench_baseline.json        # сравнить и найти регрессии
+
+Все сценарии детерминированы (фиксированный seed). Для каждого сценария берется
+лучшее время из нескольких повторов. Если сценарий стал медленнее базового
+больше чем на --tolerance, он помечается как регрессия, а код выхода равен 1.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from poker_engine import Card, PokerGame, PokerHandEvaluator
+
+SEED = 12345
+
+
+def _timeit(func: Callable[[], int], repeat: int) -> Dict[str, float]:
+    """func выполняет пачку операций и возвращает их число; берем лучший из повторов"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        ops = func()
+        elapsed = time.perf_counter() - started
+        per_op = elapsed / ops
+        if best is None or per_op < best:
+            best = per_op
+    return {"us_per_op": round(best * 1e6, 3), "ops_per_sec": round(1 / best, 1)}
+
+
+def _random_hands(size: int, count: int) -> List[List[Card]]:
+    rng = random.Random(SEED + size)
+    deck = [Card.from_code(code) for code in range(52)]
+    return [rng.sample(deck, size) for _ in range(count)]
+
+
+# ========== Сценарии ==========
+
+def bench_evaluator(repeat: int) -> Dict[str, dict]:
+    results = {}
+    for size in (5, 6, 7):
+        hands = _random_hands(size, 5000)
+
+        def run():
+            for hand in hands:
+                PokerHandEvaluator.evaluate(hand)
+            return len(hands)
+
+        results[f"evaluate_{size}_cards"] = _timeit(run, repeat)
+
+    hands = _random_hands(7, 5000)
+
+    def run_strength():
+        for hand in hands:
+            PokerHandEvaluator.evaluate_strength(hand)
+        return len(hands)
+
+    results["evaluate_strength_7_cards"] = _timeit(run_strength, repeat)
+    return results
+
+
+def _play_hand(game: PokerGame, rng: random.Random):
+    game.start_game()
+    while game.stage != "showdown":
+        player = game.get_current_player()
+        action = rng.choice(["call", "call", "check", "fold", "raise"])
+        if not game.player_action(player.user_id, action, max(game.current_bet * 2, game.big_blind)):
+            game.player_action(player.user_id, "call")
+
+
+def bench_game(repeat: int) -> Dict[str, dict]:
+    results = {}
+    for players in (2, 6, 9):
+        def run():
+            random.seed(SEED)
+            rng = random.Random(SEED)
+            game = PokerGame("bench")
+            for seat in range(players):
+                game.add_player(seat + 1, f"Player {seat + 1}", 10 ** 9)
+            for hand in range(300):
+                game.dealer_position = hand % players
+                _play_hand(game, rng)
+            return 300
+
+        results[f"hand_lifecycle_{players}_players"] = _timeit(run, repeat)
+    return results
+
+
+def bench_database(repeat: int) -> Dict[str, dict]:
+    from database import Database
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        users = list(range(1, 501))
+        for user_id in users:
+            db.get_or_create_player(user_id, f"user{user_id}", f"User {user_id}")
+
+        def run_get():
+            for user_id in users:
+                db.get_or_create_player(user_id, f"user{user_id}", f"User {user_id}")
+            return len(users)
+
+        def run_add_chips():
+            for user_id in users[:200]:
+                db.add_chips(user_id, 10)
+            return 200
+
+        def run_leaderboard():
+            for _ in range(200):
+                db.get_leaderboard(10)
+            return 200
+
+        results["db_get_or_create_player"] = _timeit(run_get, repeat)
+        results["db_add_chips"] = _timeit(run_add_chips, repeat)
+        results["db_get_leaderboard"] = _timeit(run_leaderboard, repeat)
+        db.engine.dispose()
+    return results
+
+
+def bench_render(repeat: int) -> Dict[str, dict]:
+    # bot.py при импорте открывает базу в текущей папке - импортируем его из временной
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            from bot import TableRenderer
+        finally:
+            os.chdir(cwd)
+
+        for players in range(2, 10):
+            random.seed(SEED)
+            game = PokerGame("bench")
+            for seat in range(players):
+                game.add_player(seat + 1, f"Player {seat + 1}", 1000 + seat * 250)
+            game.start_game()
+
+            # Полная отрисовка - новый TableRenderer без кэша, сравнима с прежними замерами
+            def run():
+                for _ in range(500):
+                    TableRenderer().render(game)
+                return 500
+
+            renderer = TableRenderer()
+            renderer.render(game)
+
+            # Стол не менялся - текст берется из кэша
+            def run_cached():
+                for _ in range(500):
+                    renderer.render(game)
+                return 500
+
+            # Меняются фишки одного игрока - пересобирается одно место
+            def run_one_seat():
+                player = game.players[0]
+                for i in range(500):
+                    player.chips += 1 if i % 2 else -1
+                    renderer.render(game)
+                return 500
+
+            results[f"format_game_table_{players}_seats"] = _timeit(run, repeat)
+            results[f"format_game_table_{players}_seats_cached"] = _timeit(run_cached, repeat)
+            results[f"format_game_table_{players}_seats_one_seat_changed"] = _timeit(run_one_seat, repeat)
+    return results
+
+
+SUITES = {
+    "evaluator": bench_evaluator,
+    "game": bench_game,
+    "db": bench_database,
+    "render": bench_render,
+}
+
+
+def find_regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Сценарии, которые стали медленнее базовых больше чем на tolerance"""
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        ratio = current["us_per_op"] / baseline[name]["us_per_op"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {baseline[name]['us_per_op']}us -> {current['us_per_op']}us (x{ratio:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки Poker Club Bot")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"Наборы через запятую: {', '.join(SUITES)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", help="JSON с базовыми результатами для сравнения")
+    parser.add_argument("--save-baseline", help="Сохранить результаты как базовые")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое замедление (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    results = {}
+    for suite in args.only.split(","):
+        suite_results = SUITES[suite](args.repeat)
+        for name, value in suite_results.items():
+            print(f"{name:48s} {value['us_per_op']:>12.3f} us/op {value['ops_per_sec']:>14.1f} op/s")
+        results.update(suite_results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nРегрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import logging
+from collections import OrderedDict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import (
     Application,
@@ -9,8 +11,12 @@ from telegram.ext import (
 )
 from telegram.constants import ParseMode
 from dotenv import load_dotenv
-from database import Database
+from database import AsyncDatabase, Database, SettlementBuffer
 from poker_engine import PokerGame, Player as PokerPlayer
+from hand_history import HandHistoryRecorder, HandHistoryWriter
+from journal import Journal
+from stats import StyleTracker, style_summary
+from table_store import TableStore, hand_results
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -23,10 +29,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация базы данных
-db = Database()
+db = AsyncDatabase(Database())
+settlement = SettlementBuffer(db)
 
-# Активные игры (в памяти)
+# Раз в сколько секунд фиксировать балансы для аудита фишек
+BALANCE_SNAPSHOT_INTERVAL = 3600
+
+# Активные игры (в памяти, копия состояния - в game_tables)
 active_games = {}
+journal = Journal(os.getenv('JOURNAL_DIR', 'journal'))
+table_store = TableStore(db, journal=journal)
+# Стиль игры (VPIP, PFR, AF, WTSD) - один счетчик на все столы
+style_tracker = StyleTracker(db)
+
+# История раздач в бинарных сегментах
+hand_history = HandHistoryWriter(os.getenv('HAND_HISTORY_DIR', 'hand_history'))
 
 
 def format_chips(amount):
@@ -45,8 +62,25 @@ def get_progress_bar(current, max_val, length=10):
     return bar
 
 
-def format_player_card(player_profile):
-    """Красивая карточка игрока"""
+def format_style(style):
+    """Строки стиля игры для карточки; пусто, пока нет сыгранных раздач"""
+    if not style or not style["hands"]:
+        return ""
+    summary = style_summary(style)
+
+    def percent(value):
+        return f"{value:.0f}%" if value is not None else "—"
+
+    af = f"{summary['af']:.1f}" if summary["af"] is not None else "—"
+    return f"""│
+│ 🎲 Стиль ({style["hands"]} раздач):
+│   VPIP: {percent(summary["vpip"])}  PFR: {percent(summary["pfr"])}
+│   AF: {af}  WTSD: {percent(summary["wtsd"])}
+"""
+
+
+def format_player_card(player_profile, style=None):
+    """Красивая карточка игрока; style - счетчики StyleTracker"""
     win_rate = (player_profile.games_won / player_profile.total_games * 100) if player_profile.total_games > 0 else 0
 
     card = f"""
@@ -60,90 +94,167 @@ def format_player_card(player_profile):
 │   Игр: {player_profile.total_games}
 │   Побед: {player_profile.games_won} ({win_rate:.1f}%)
 │   Выигрыш: {format_chips(player_profile.total_winnings)}
-╰─────────────────────╯
+{format_style(style)}╰─────────────────────╯
 """
     return card
 
 
-def format_game_table(game: PokerGame, current_player_id=None):
-    """Красивое отображение игрового стола"""
-    stage_emoji = {
-        "waiting": "⏳",
-        "preflop": "🎴",
-        "flop": "🃏",
-        "turn": "🎯",
-        "river": "🌊",
-        "showdown": "🏆"
-    }
-
-    stage_name = {
-        "waiting": "Ожидание",
-        "preflop": "Префлоп",
-        "flop": "Флоп",
-        "turn": "Терн",
-        "river": "Ривер",
-        "showdown": "Вскрытие"
-    }
-
-    message = f"""
+STAGE_EMOJI = {
+    "waiting": "⏳",
+    "preflop": "🎴",
+    "flop": "🃏",
+    "turn": "🎯",
+    "river": "🌊",
+    "showdown": "🏆"
+}
+
+STAGE_NAMES = {
+    "waiting": "Ожидание",
+    "preflop": "Префлоп",
+    "flop": "Флоп",
+    "turn": "Терн",
+    "river": "Ривер",
+    "showdown": "Вскрытие"
+}
+
+
+def format_seat(player: PokerPlayer, is_current: bool, is_dealer: bool):
+    """Строки одного игрока за столом"""
+    if player.folded:
+        status = "❌ Fold"
+    elif player.all_in:
+        status = "🔥 All-in"
+    else:
+        status = "✅"
+
+    chips_bar = get_progress_bar(player.chips, 2000, 8)
+
+    fragment = f"{'➤ ' if is_current else '  '}{'🔴 ' if is_dealer else ''}<b>{player.name}</b>\n"
+    fragment += f"   {chips_bar} <code>{format_chips(player.chips)}</code> {status}\n"
+    if player.current_bet > 0:
+        fragment += f"   💵 Ставка: <code>{format_chips(player.current_bet)}</code>\n"
+    return fragment + "\n"
+
+
+class TableRenderer:
+    """
+    Отрисовка одного стола с кэшем: строки места пересобираются, только если
+    изменилось что-то видимое у этого игрока, весь текст - только если изменился стол
+    """
+
+    def __init__(self):
+        self._seats = []  # [(ключ места, строки места)]
+        self._key = None
+        self._text = None
+
+    def render(self, game: PokerGame):
+        current = game.get_current_player()
+        current_id = current.user_id if current else None
+        seat_keys = [
+            (p.user_id, p.name, p.chips, p.current_bet, p.folded, p.all_in,
+             p.user_id == current_id, i == game.dealer_position)
+            for i, p in enumerate(game.players)
+        ]
+        key = (game.stage, game.pot, game.current_bet, tuple(c.code for c in game.community_cards),
+               tuple(seat_keys))
+        if key == self._key:
+            return self._text
+
+        del self._seats[len(seat_keys):]
+        for i, (player, seat_key) in enumerate(zip(game.players, seat_keys)):
+            if i < len(self._seats) and self._seats[i][0] == seat_key:
+                continue
+            entry = (seat_key, format_seat(player, seat_key[-2], seat_key[-1]))
+            if i < len(self._seats):
+                self._seats[i] = entry
+            else:
+                self._seats.append(entry)
+
+        message = f"""
 ╔══════════════════════════╗
 ║   🎰 <b>TEXAS HOLD'EM</b> 🎰   ║
 ╚══════════════════════════╝
 
-{stage_emoji.get(game.stage, '🎲')} <b>Стадия:</b> {stage_name.get(game.stage, game.stage)}
+{STAGE_EMOJI.get(game.stage, '🎲')} <b>Стадия:</b> {STAGE_NAMES.get(game.stage, game.stage)}
 💰 <b>Банк:</b> <code>{format_chips(game.pot)}</code>
 
 """
 
-    # Общие карты
-    if game.community_cards:
-        cards_str = " ".join([str(card) for card in game.community_cards])
-        message += f"🎴 <b>Стол:</b> {cards_str}\n\n"
-    else:
-        message += f"🎴 <b>Стол:</b> [ - - - - - ]\n\n"
-
-    # Игроки
-    message += "👥 <b>Игроки:</b>\n"
-    for i, player in enumerate(game.players):
-        if player.folded:
-            status = "❌ Fold"
-        elif player.all_in:
-            status = "🔥 All-in"
+        # Общие карты
+        if game.community_cards:
+            cards_str = " ".join([str(card) for card in game.community_cards])
+            message += f"🎴 <b>Стол:</b> {cards_str}\n\n"
         else:
-            status = "✅"
+            message += f"🎴 <b>Стол:</b> [ - - - - - ]\n\n"
 
-        is_current = "➤ " if (game.get_current_player() and player.user_id == game.get_current_player().user_id) else "  "
-        is_dealer = "🔴 " if i == game.dealer_position else ""
+        # Игроки
+        message += "👥 <b>Игроки:</b>\n"
+        message += "".join(fragment for _, fragment in self._seats)
 
-        chips_bar = get_progress_bar(player.chips, 2000, 8)
+        # Текущий ход
+        if current:
+            message += f"⏱ <b>Ход игрока:</b> {current.name}\n"
+            message += f"💵 <b>Текущая ставка:</b> <code>{format_chips(game.current_bet)}</code>\n"
 
-        message += f"{is_current}{is_dealer}<b>{player.name}</b>\n"
-        message += f"   {chips_bar} <code>{format_chips(player.chips)}</code> {status}\n"
+        self._key = key
+        self._text = message
+        return message
 
-        if player.current_bet > 0:
-            message += f"   💵 Ставка: <code>{format_chips(player.current_bet)}</code>\n"
-        message += "\n"
 
-    # Текущий ход
-    current = game.get_current_player()
-    if current:
-        message += f"⏱ <b>Ход игрока:</b> {current.name}\n"
-        message += f"💵 <b>Текущая ставка:</b> <code>{format_chips(game.current_bet)}</code>\n"
+# game_id -> TableRenderer
+table_renderers = {}
 
-    return message
+
+def format_game_table(game: PokerGame, current_player_id=None):
+    """Красивое отображение игрового стола"""
+    renderer = table_renderers.get(game.game_id)
+    if renderer is None:
+        renderer = table_renderers[game.game_id] = TableRenderer()
+    return renderer.render(game)
+
+
+# Последнее отправленное содержимое сообщений: сообщение -> хэш текста и кнопок
+LAST_EDITS_LIMIT = 1024
+last_edits = OrderedDict()
+
+
+def keyboard_digest(keyboard):
+    return tuple(
+        tuple((button.text, button.callback_data, button.switch_inline_query) for button in row)
+        for row in keyboard
+    )
+
+
+async def edit_table_message(query, message, keyboard):
+    """
+    edit_message_text для сообщения стола; если текст и кнопки не изменились
+    с прошлой правки этого сообщения, запрос в Telegram не отправляется
+    """
+    message_key = query.inline_message_id or (query.message.chat_id, query.message.message_id)
+    digest = hash((message, keyboard_digest(keyboard)))
+    if last_edits.get(message_key) == digest:
+        last_edits.move_to_end(message_key)
+        return False
+
+    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+    last_edits[message_key] = digest
+    last_edits.move_to_end(message_key)
+    if len(last_edits) > LAST_EDITS_LIMIT:
+        last_edits.popitem(last=False)
+    return True
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start"""
     user = update.effective_user
-    player = db.get_or_create_player(user.id, user.username, user.full_name)
+    player = await db.get_or_create_player(user.id, user.username, user.full_name)
 
     welcome_msg = f"""
 🎰 <b>Добро пожаловать в Poker Club!</b> 🎰
 
 Привет, {user.first_name}! Готов сыграть в Texas Hold'em?
 
-{format_player_card(player)}
+{format_player_card(player, await style_tracker.get(user.id))}
 
 <b>🎮 Команды:</b>
 /play - Создать или присоединиться к игре
@@ -172,9 +283,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать баланс и статистику"""
     user = update.effective_user
-    player = db.get_or_create_player(user.id, user.username, user.full_name)
+    player = await db.get_or_create_player(user.id, user.username, user.full_name)
 
-    message = format_player_card(player)
+    message = format_player_card(player, await style_tracker.get(user.id))
 
     keyboard = [
         [
@@ -191,10 +302,10 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ежедневный бонус"""
     user = update.effective_user
-    bonus = db.get_daily_bonus(user.id)
+    bonus = await db.get_daily_bonus(user.id)
 
     if bonus:
-        player = db.get_or_create_player(user.id, user.username, user.full_name)
+        player = await db.get_or_create_player(user.id, user.username, user.full_name)
         message = f"""
 🎁 <b>Ежедневный бонус получен!</b>
 
@@ -215,9 +326,39 @@ async def daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
 
+WINDOW_TITLES = {"day": "сегодня", "week": "неделю", "month": "месяц"}
+
+
+def leaderboard_keyboard():
+    """Кнопки под таблицей лидеров: обновить и окна по времени"""
+    return [
+        [
+            InlineKeyboardButton("📅 День", callback_data="top_day"),
+            InlineKeyboardButton("🗓 Неделя", callback_data="top_week"),
+            InlineKeyboardButton("📆 Месяц", callback_data="top_month"),
+        ],
+        [InlineKeyboardButton("🔄 Обновить", callback_data="leaderboard")],
+    ]
+
+
+def format_window_leaderboard(window, rows):
+    """Лучшие по чистому выигрышу за окно"""
+    message = f"🏆 <b>Лучшие за {WINDOW_TITLES[window]}</b>\n\n"
+    if not rows:
+        return message + "<i>Раздач за это время не было</i>\n"
+
+    medals = ["🥇", "🥈", "🥉"]
+    for i, row in enumerate(rows, 1):
+        medal = medals[i-1] if i <= 3 else f"{i}."
+        sign = "+" if row["chips_won"] > 0 else ""
+        message += f"{medal} <b>{row['name']}</b>\n"
+        message += f"   💰 {sign}{format_chips(row['chips_won'])} | 🃏 {row['hands']} | 🏆 {row['wins']}\n\n"
+    return message
+
+
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Таблица лидеров"""
-    leaders = db.get_leaderboard(10)
+    leaders = await db.get_leaderboard(10)
 
     message = """
 ╔═══════════════════════════╗
@@ -237,7 +378,11 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message += f"   💰 Фишки: <code>{format_chips(player.chips)}</code>\n"
         message += f"   🎯 Винрейт: <code>{win_rate:.1f}%</code> ({player.games_won}/{player.total_games})\n\n"
 
-    keyboard = [[InlineKeyboardButton("🔄 Обновить", callback_data="leaderboard")]]
+    rank = await db.get_player_rank(update.effective_user.id)
+    if rank:
+        message += f"📍 Ваше место: <code>{rank[0]}</code> из {rank[1]}\n"
+
+    keyboard = leaderboard_keyboard()
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
@@ -247,7 +392,7 @@ async def play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Создать или присоединиться к игре"""
     chat_id = update.effective_chat.id
     user = update.effective_user
-    player = db.get_or_create_player(user.id, user.username, user.full_name)
+    player = await db.get_or_create_player(user.id, user.username, user.full_name)
 
     # Проверяем, есть ли активная игра в этом чате
     if chat_id in active_games:
@@ -347,9 +492,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Ежедневный бонус
     if data == "daily_bonus":
-        bonus = db.get_daily_bonus(user.id)
+        bonus = await db.get_daily_bonus(user.id)
         if bonus:
-            player = db.get_or_create_player(user.id, user.username, user.full_name)
+            player = await db.get_or_create_player(user.id, user.username, user.full_name)
             message = f"""
 🎁 <b>Бонус получен!</b>
 
@@ -363,7 +508,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Таблица лидеров
     elif data == "leaderboard":
-        leaders = db.get_leaderboard(10)
+        leaders = await db.get_leaderboard(10)
         message = """
 ╔═══════════════════════════╗
 ║   🏆 <b>ТАБЛИЦА ЛИДЕРОВ</b> 🏆   ║
@@ -377,18 +522,42 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message += f"{medal} <b>{player.full_name}</b>\n"
             message += f"   ⭐️ {player.rating} | 💰 {format_chips(player.chips)} | 🎯 {win_rate:.1f}%\n\n"
 
-        keyboard = [[InlineKeyboardButton("🔄 Обновить", callback_data="leaderboard")]]
+        rank = await db.get_player_rank(user.id)
+        if rank:
+            message += f"📍 Ваше место: <code>{rank[0]}</code> из {rank[1]}\n"
+
+        keyboard = leaderboard_keyboard()
         await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
 
+    # Таблица лидеров за день/неделю/месяц
+    elif data.startswith("top_"):
+        window = data.split("_")[1]
+        rows = await db.get_window_leaderboard(window, 10)
+        message = format_window_leaderboard(window, rows)
+        await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(leaderboard_keyboard()),
+                                      parse_mode=ParseMode.HTML)
+
     # Создание игры
     elif data.startswith("create_"):
         game_type = data.split("_")[1]
         blinds = {"quick": (10, 20), "standard": (50, 100), "high": (100, 200)}
         sb, bb = blinds.get(game_type, (10, 20))
 
-        # Создаем игру
+        # Старая кнопка или две команды /play подряд не должны подменить идущий стол
+        if chat_id in active_games:
+            await query.answer("❌ В этом чате уже есть стол", show_alert=True)
+            return
+
+        # Создаем игру; место в active_games занимаем до записи в базу
         game = PokerGame(game_id=str(chat_id), small_blind=sb, big_blind=bb)
+        game.listeners.append(HandHistoryRecorder(hand_history))
+        game.listeners.append(style_tracker)
         active_games[chat_id] = game
+        try:
+            await table_store.add(game, chat_id, user.id)
+        except Exception:
+            del active_games[chat_id]
+            raise
 
         message = f"""
 ✅ <b>Стол создан!</b>
@@ -416,17 +585,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         game = active_games[game_chat_id]
-        player = db.get_or_create_player(user.id, user.username, user.full_name)
+        player = await db.get_or_create_player(user.id, user.username, user.full_name)
 
-        # Проверяем баланс
-        if player.chips < buy_in:
+        # Списываем фишки одним UPDATE, только если их хватает
+        balance = await db.spend_chips(user.id, buy_in, "table_buy_in")
+        if balance is None:
             await query.answer(f"❌ Недостаточно фишек! Нужно {buy_in}, у вас {player.chips}", show_alert=True)
             return
 
         # Добавляем в игру
         if game.add_player(user.id, user.full_name, buy_in):
-            # Списываем фишки
-            db.update_player_chips(user.id, player.chips - buy_in)
+            journal.log_join(game, user.id, user.full_name, buy_in)
+            table_store.mark_dirty(game)
+            await journal.sync()
 
             await query.answer("✅ Вы сели за стол!", show_alert=True)
 
@@ -439,8 +610,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 keyboard.append([InlineKeyboardButton("🎮 Начать игру", callback_data=f"start_game_{game_chat_id}")])
             keyboard.append([InlineKeyboardButton("➕ Пригласить друзей", switch_inline_query="Присоединяйся к покеру!")])
 
-            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+            await edit_table_message(query, message, keyboard)
         else:
+            await db.add_chips(user.id, buy_in, "table_refund")
             await query.answer("❌ Не удалось присоединиться", show_alert=True)
 
     # Начало игры
@@ -454,6 +626,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         game = active_games[game_chat_id]
 
         if game.start_game():
+            await journal.sync()
             message = format_game_table(game)
 
             current_player = game.get_current_player()
@@ -473,7 +646,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     [InlineKeyboardButton("🔥 All-in", callback_data=f"action_{game_chat_id}_all_in")]
                 ]
 
-            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+            await edit_table_message(query, message, keyboard)
         else:
             await query.answer("❌ Недостаточно игроков для старта", show_alert=True)
 
@@ -496,31 +669,42 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Выполняем действие
         if game.player_action(user.id, action):
+            await journal.sync()
             message = format_game_table(game)
 
             # Проверяем, закончилась ли игра
             if game.stage == "showdown":
-                # Показываем результаты
-                winners, hands, best_cards = game._go_to_showdown()
+                # Показываем результаты (посчитаны движком один раз при переходе к вскрытию)
+                result = game.showdown_result
 
                 message += "\n🏆 <b>РЕЗУЛЬТАТЫ:</b>\n\n"
-                for i, winner in enumerate(winners):
+                for winner in result.winners:
                     message += f"👑 <b>{winner.name}</b>\n"
-                    message += f"   Комбинация: {hands[i].name_ru}\n"
-                    message += f"   Карты: {' '.join([str(c) for c in best_cards[i]])}\n"
-                    message += f"   Выигрыш: 💰 <code>{format_chips(game.pot // len(winners))}</code>\n\n"
-
-                # Обновляем статистику
-                for winner in winners:
-                    db.update_player_stats(winner.user_id, won=True, winnings=game.pot // len(winners))
-                    player_profile = db.get_or_create_player(winner.user_id, "", winner.name)
-                    db.add_chips(winner.user_id, game.pot // len(winners))
+                    if winner.user_id in result.hands:
+                        rank, _, best_cards = result.hands[winner.user_id]
+                        message += f"   Комбинация: {rank.name_ru}\n"
+                        message += f"   Карты: {' '.join([str(c) for c in best_cards])}\n"
+                    message += f"   Выигрыш: 💰 <code>{format_chips(result.payouts[winner.user_id])}</code>\n\n"
+
+                # Шансы игроков на момент олл-ина
+                if game.all_in_equity:
+                    message += "📊 <b>Шансы при олл-ине:</b>\n"
+                    for player in game.players:
+                        if player.user_id in game.all_in_equity:
+                            equity = game.all_in_equity[player.user_id]["equity"]
+                            message += f"   {player.name}: <code>{equity * 100:.1f}%</code>\n"
+                    message += "\n"
+
+                # Стол закрывается: все участники забирают стек, статистика - всем
+                # Стол помечается завершенным в той же транзакции, что и возврат стеков
+                settlement.add(hand_results(game), table_store.release(game))
 
                 # Удаляем игру
+                table_renderers.pop(game.game_id, None)
                 del active_games[game_chat_id]
 
                 keyboard = [[InlineKeyboardButton("🔄 Новая игра", callback_data="create_game")]]
-                await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+                await edit_table_message(query, message, keyboard)
             else:
                 # Продолжаем игру
                 next_player = game.get_current_player()
@@ -539,7 +723,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         [InlineKeyboardButton("🔥 All-in", callback_data=f"action_{game_chat_id}_all_in")]
                     ]
 
-                await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+                await edit_table_message(query, message, keyboard)
         else:
             await query.answer("❌ Невозможное действие", show_alert=True)
 
@@ -554,7 +738,40 @@ def main():
         logger.error("Не найден BOT_TOKEN в переменных окружения!")
         return
 
-    application = Application.builder().token(token).build()
+    # Возвращаем столы, которые шли до перезапуска
+    for chat_id, game in table_store.restore():
+        if chat_id in active_games:
+            # Несколько столов в одном чате (остались от старых версий): оставляем последний,
+            # у остальных возвращаем стеки на балансы
+            logger.warning(f"Лишний стол {active_games[chat_id].game_id} в чате {chat_id} закрыт")
+            table_store.close(active_games.pop(chat_id))
+        game.listeners.append(HandHistoryRecorder(hand_history))
+        game.listeners.append(style_tracker)
+        active_games[chat_id] = game
+    logger.info(f"Восстановлено столов: {len(active_games)}")
+
+    async def snapshot_balances():
+        # Снимки балансов, чтобы аудит фишек не читал весь журнал; заодно чистим старые снимки и дневные итоги
+        while True:
+            await asyncio.sleep(BALANCE_SNAPSHOT_INTERVAL)
+            await db.snapshot_balances()
+            await db.prune_balance_snapshots()
+            await db.prune_daily_stats()
+            logger.info(f"Кэш профилей: {db.cache.stats()}")
+
+    async def start_snapshots(application):
+        # Первый снимок - сразу: у игроков, созданных до журнала фишек, без снимка аудит не сходится
+        await db.snapshot_balances()
+        application.create_task(snapshot_balances())
+
+    async def flush_tables(application):
+        table_store.flush()
+        settlement.flush()
+        style_tracker.flush()
+        journal.close()
+        db.close()
+
+    application = Application.builder().token(token).post_init(start_snapshots).post_shutdown(flush_tables).build()
 
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
@@ -1,11 +1,63 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Float, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Float, JSON
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import bindparam, event, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from functools import partial, wraps
+import asyncio
+import json
+import heapq
+import logging
 import os
+import threading
+import time
+
+from rating import apply_hand
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Изменение рейтинга в update_player_stats (в итогах раздач - Эло, см. rating.py)
+RATING_WIN = 10
+RATING_LOSS = -5
+
+# Окна таблиц лидеров по дням; дневные итоги старше самого длинного окна удаляются
+STATS_WINDOWS = {"day": 1, "week": 7, "month": 30}
+DAILY_STATS_KEEP_DAYS = max(STATS_WINDOWS.values())
+
+# Счетчики PlayerStyleStats
+STYLE_COUNTERS = ("hands", "vpip", "pfr", "aggressive", "calls", "saw_flop", "showdowns")
+
+
+def _merge_patch(target, patch):
+    """JSON Merge Patch (RFC 7396): как json_patch в SQLite"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = _merge_patch(result.get(key), value)
+    return result
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """WAL: чтение не ждет записи; NORMAL: fsync только на чекпоинтах WAL"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 
 class PlayerProfile(Base):
     """Профиль игрока с балансом и статистикой"""
@@ -19,7 +71,7 @@ class PlayerProfile(Base):
     total_games = Column(Integer, default=0)
     games_won = Column(Integer, default=0)
     total_winnings = Column(Integer, default=0)
-    rating = Column(Integer, default=1000)  # ELO рейтинг
+    rating = Column(Integer, default=1000, index=True)  # ELO рейтинг
     created_at = Column(DateTime, default=datetime.utcnow)
     last_daily_bonus = Column(DateTime)
 
@@ -124,270 +176,997 @@ class GameHistory(Base):
     finished_at = Column(DateTime, default=datetime.utcnow)
 
 
+class GameHistoryParticipant(Base):
+    """Участник завершенной раздачи - по этим строкам пересчитывается рейтинг"""
+    __tablename__ = 'game_history_participants'
+
+    id = Column(Integer, primary_key=True)
+    history_id = Column(Integer, ForeignKey('game_history.id'), nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    profit = Column(Integer, default=0)  # Чистый результат раздачи
+    won = Column(Boolean, default=False)
+
+
+class ChipLedger(Base):
+    """Журнал движения фишек (только добавление строк)"""
+    __tablename__ = 'chip_ledger'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    delta = Column(Integer, nullable=False)
+    balance = Column(Integer, nullable=False)  # Баланс после операции
+    reason = Column(String, nullable=False)  # initial, bonus, table_buy_in, table_cash_out, tournament_buy_in, ...
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ChipBalanceSnapshot(Base):
+    """Баланс игрока на момент строки журнала ledger_id - аудит считает только то, что после"""
+    __tablename__ = 'chip_balance_snapshots'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    balance = Column(Integer, nullable=False)
+    ledger_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ProfileCache:
+    """
+    LRU-кэш профилей по user_id: не больше max_size записей, каждая живет ttl секунд
+    Потокобезопасный: читают обработчики, обновляет поток базы после commit
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (время устаревания, профиль)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, profile):
+        with self._lock:
+            self._entries[profile.user_id] = (time.monotonic() + self.ttl, profile)
+            self._entries.move_to_end(profile.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, user_id, **fields):
+        """Поменять поля закэшированного профиля (если он в кэше)"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                for name, value in fields.items():
+                    setattr(entry[1], name, value)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+class RatingIndex:
+    """
+    Рейтинги всех игроков в памяти: дерево Фенвика по значению рейтинга дает место
+    игрока за O(log R) без COUNT(*), отсортированный топ из top_size игроков - таблицу лидеров
+    """
+
+    def __init__(self, top_size=100):
+        self.top_size = top_size
+        self.loaded = False
+        self._ratings = {}  # user_id -> рейтинг
+        self._tree = [0] * 4097  # индекс = рейтинг + 1
+        self._top = []  # первые top_size пар (-рейтинг, user_id) по возрастанию
+        self._lock = threading.RLock()
+
+    def load(self, rows):
+        """Заполнить из (user_id, rating) всех игроков"""
+        with self._lock:
+            self._ratings = dict(rows)
+            self._rebuild_tree()
+            self._rebuild_top()
+            self.loaded = True
+
+    def _rebuild_tree(self):
+        size = len(self._tree)
+        top_rating = max(self._ratings.values(), default=0)
+        while size <= top_rating + 1:
+            size *= 2
+        self._tree = [0] * size
+        for rating in self._ratings.values():
+            self._add(rating, 1)
+
+    def _rebuild_top(self):
+        self._top = heapq.nsmallest(self.top_size, ((-rating, user_id) for user_id, rating in self._ratings.items()))
+
+    def _add(self, rating, count):
+        i = rating + 1
+        while i < len(self._tree):
+            self._tree[i] += count
+            i += i & -i
+
+    def _count_upto(self, rating):
+        """Сколько игроков с рейтингом <= rating"""
+        i = min(rating + 1, len(self._tree) - 1)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def set(self, user_id, rating):
+        """Новый рейтинг игрока (или новый игрок)"""
+        rating = max(rating, 0)
+        with self._lock:
+            if not self.loaded:
+                return  # Значение из базы попадет в load
+            old = self._ratings.get(user_id)
+            if old == rating:
+                return
+            self._ratings[user_id] = rating
+            if rating + 1 >= len(self._tree):
+                self._rebuild_tree()
+            else:
+                if old is not None:
+                    self._add(old, -1)
+                self._add(rating, 1)
+
+            was_in_top = False
+            if old is not None:
+                position = bisect_left(self._top, (-old, user_id))
+                if position < len(self._top) and self._top[position] == (-old, user_id):
+                    del self._top[position]
+                    was_in_top = True
+
+            entry = (-rating, user_id)
+            if len(self._ratings) <= self.top_size:
+                # В топ помещаются все игроки
+                insort(self._top, entry)
+            elif self._top and entry < self._top[-1]:
+                # Рейтинг пересек порог топа
+                insort(self._top, entry)
+                if len(self._top) > self.top_size:
+                    self._top.pop()
+            elif was_in_top:
+                # Игрок выпал из топа - его место займет кто-то из остальных
+                self._rebuild_top()
+
+    def top(self, limit):
+        with self._lock:
+            return [user_id for _, user_id in self._top[:limit]]
+
+    def rank(self, user_id):
+        """(место, всего игроков) или None"""
+        with self._lock:
+            rating = self._ratings.get(user_id)
+            if rating is None:
+                return None
+            total = len(self._ratings)
+            return total - self._count_upto(rating) + 1, total
+
+
+class PlayerDailyStats(Base):
+    """Итоги игрока за день - из них собираются таблицы лидеров за день/неделю/месяц"""
+    __tablename__ = 'player_daily_stats'
+    __table_args__ = (UniqueConstraint('user_id', 'day'),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False, index=True)  # UTC
+    chips_won = Column(Integer, default=0)  # Чистый выигрыш за день (может быть отрицательным)
+    hands = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+
+
+class PlayerStyleStats(Base):
+    """Счетчики стиля игры (VPIP, PFR, агрессия, вскрытия) - накопленные за все раздачи"""
+    __tablename__ = 'player_style_stats'
+
+    user_id = Column(Integer, primary_key=True)
+    hands = Column(Integer, default=0)
+    vpip = Column(Integer, default=0)  # Раздачи с добровольным вложением префлоп
+    pfr = Column(Integer, default=0)  # Раздачи с рейзом префлоп
+    aggressive = Column(Integer, default=0)  # Рейзы и олл-ины
+    calls = Column(Integer, default=0)
+    saw_flop = Column(Integer, default=0)
+    showdowns = Column(Integer, default=0)
+
+
 class Database:
-    def __init__(self, db_url='sqlite:///poker_game.db'):
-        self.engine = create_engine(db_url)
+    """
+    Доступ к базе. Каждый метод - отдельная единица работы со своей сессией из пула,
+    поэтому методы можно вызывать из нескольких потоков одновременно
+    """
+
+    def __init__(self, db_url=None, pool_size=5, max_overflow=10, cache_size=10000, cache_ttl=300.0):
+        # DATABASE_URL из окружения; просто имя файла - путь к SQLite
+        db_url = db_url or os.getenv('DATABASE_URL', 'sqlite:///poker_game.db')
+        if "://" not in db_url:
+            db_url = f"sqlite:///{db_url}"
+
+        if db_url.startswith("sqlite"):
+            pool = {}
+            if make_url(db_url).database not in (None, "", ":memory:"):
+                # SQLite в памяти живет в одном соединении (SingletonThreadPool/StaticPool) -
+                # размер пула задается только для файла
+                pool = {"pool_size": pool_size, "max_overflow": max_overflow}
+            self.engine = create_engine(
+                db_url,
+                connect_args={"check_same_thread": False, "timeout": 30},
+                **pool,
+            )
+            event.listen(self.engine, "connect", _configure_sqlite)
+        else:
+            self.engine = create_engine(
+                db_url,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_pre_ping=True,
+                pool_recycle=1800,
+            )
         Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        # create_all не добавляет индексы в уже существующие таблицы
+        for index in PlayerProfile.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        # Объекты остаются читаемыми после commit и закрытия сессии -
+        # их можно отдавать из потока базы в обработчики
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.cache = ProfileCache(cache_size, cache_ttl)
+        self.ratings = RatingIndex()
+
+    @contextmanager
+    def session_scope(self):
+        """Единица работы: commit при успехе, rollback при ошибке, сессия всегда закрывается"""
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+            # Кэш меняем только после успешного commit
+            for callback in session.info.pop("after_commit", ()):
+                callback()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     # ========== Профили игроков ==========
 
     def get_or_create_player(self, user_id, username, full_name):
         """Получить или создать профиль игрока"""
-        player = self.session.query(PlayerProfile).filter_by(user_id=user_id).first()
-
-        if not player:
-            player = PlayerProfile(
-                user_id=user_id,
-                username=username,
-                full_name=full_name,
-                chips=1000  # Начальные фишки
-            )
-            self.session.add(player)
-            self.session.commit()
-
-        return player
+        player = self.cache.get(user_id)
+        if player is not None:
+            return player
+
+        with self.session_scope() as session:
+            player = session.query(PlayerProfile).filter_by(user_id=user_id).first()
+
+            if not player:
+                player = PlayerProfile(
+                    user_id=user_id,
+                    username=username,
+                    full_name=full_name,
+                    chips=1000  # Начальные фишки
+                )
+                session.add(player)
+                session.add(ChipLedger(user_id=user_id, delta=1000, balance=1000, reason="initial"))
+
+            self._after_commit(session, self.cache.put, player)
+            # Рейтинг нового игрока появится только после INSERT - читаем его после commit
+            self._after_commit(session, lambda: self.ratings.set(user_id, player.rating))
+            return player
+
+    # ========== Фишки ==========
+    # Баланс меняется только одним UPDATE ... RETURNING на стороне базы,
+    # каждое изменение пишется в chip_ledger в той же транзакции
+
+    @staticmethod
+    def _after_commit(session, callback, *args, **kwargs):
+        session.info.setdefault("after_commit", []).append(partial(callback, *args, **kwargs))
+
+    def _move_chips(self, session, condition, delta, reason, **values):
+        """
+        chips += delta у профиля по условию, если баланс не станет отрицательным;
+        values - другие поля профиля. Возвращает новый баланс или None (нет игрока / не хватает фишек)
+        """
+        table = PlayerProfile.__table__
+        if delta < 0:
+            condition &= table.c.chips >= -delta
+        row = session.execute(
+            update(table).where(condition).values(chips=table.c.chips + delta, **values)
+            .returning(table.c.user_id, table.c.chips)
+        ).first()
+        if row is None:
+            return None
+        session.add(ChipLedger(user_id=row.user_id, delta=delta, balance=row.chips, reason=reason))
+        self._after_commit(session, self.cache.update, row.user_id, chips=row.chips, **values)
+        return row.chips
 
-    def update_player_chips(self, user_id, chips):
+    def update_player_chips(self, user_id, chips, reason="set"):
         """Обновить количество фишек игрока"""
-        player = self.session.query(PlayerProfile).filter_by(user_id=user_id).first()
-        if player:
-            player.chips = chips
-            self.session.commit()
-            return True
-        return False
-
-    def add_chips(self, user_id, amount):
+        table = PlayerProfile.__table__
+        with self.session_scope() as session:
+            # Сначала запись в журнал с разницей, посчитанной базой, затем сам UPDATE
+            session.execute(insert(ChipLedger.__table__).from_select(
+                ["user_id", "delta", "balance", "reason", "created_at"],
+                select(table.c.user_id, literal(chips) - table.c.chips, literal(chips), literal(reason),
+                       literal(datetime.utcnow())).where(table.c.user_id == user_id)
+            ))
+            updated = session.execute(
+                update(table).where(table.c.user_id == user_id).values(chips=chips)
+            ).rowcount
+            self._after_commit(session, self.cache.update, user_id, chips=chips)
+            return updated > 0
+
+    def add_chips(self, user_id, amount, reason="add"):
         """Добавить фишки игроку"""
-        player = self.session.query(PlayerProfile).filter_by(user_id=user_id).first()
-        if player:
-            player.chips += amount
-            self.session.commit()
-            return player.chips
-        return None
+        with self.session_scope() as session:
+            return self._move_chips(session, PlayerProfile.user_id == user_id, amount, reason)
+
+    def spend_chips(self, user_id, amount, reason):
+        """Списать фишки, только если их хватает; новый баланс или None"""
+        with self.session_scope() as session:
+            return self._move_chips(session, PlayerProfile.user_id == user_id, -amount, reason)
 
     def get_daily_bonus(self, user_id):
         """Получить ежедневный бонус"""
-        player = self.session.query(PlayerProfile).filter_by(user_id=user_id).first()
-        if not player:
-            return None
-
         now = datetime.utcnow()
-        if player.last_daily_bonus:
-            hours_since_last = (now - player.last_daily_bonus).total_seconds() / 3600
-            if hours_since_last < 24:
-                return None  # Бонус уже получен сегодня
-
         bonus = 100
-        player.chips += bonus
-        player.last_daily_bonus = now
-        self.session.commit()
-        return bonus
+        # Бонус уже получен сегодня - строка не подходит под условие
+        condition = (PlayerProfile.user_id == user_id) & (
+            PlayerProfile.last_daily_bonus.is_(None) | (PlayerProfile.last_daily_bonus <= now - timedelta(hours=24))
+        )
+        with self.session_scope() as session:
+            if self._move_chips(session, condition, bonus, "bonus", last_daily_bonus=now) is None:
+                return None
+            return bonus
+
+    def snapshot_balances(self):
+        """
+        Зафиксировать балансы на текущей строке журнала - только у игроков,
+        у которых были движения фишек после прошлого снимка (в первый раз - у всех)
+        Возвращает ledger_id снимка
+        """
+        table = PlayerProfile.__table__
+        with self.session_scope() as session:
+            last_id = session.query(func.coalesce(func.max(ChipLedger.id), 0)).scalar()
+            previous_id = session.query(func.max(ChipBalanceSnapshot.ledger_id)).scalar()
+            rows = select(table.c.user_id, table.c.chips, literal(last_id), literal(datetime.utcnow()))
+            if previous_id is not None:
+                if previous_id >= last_id:
+                    return last_id
+                changed = select(ChipLedger.user_id).where(
+                    ChipLedger.id > previous_id, ChipLedger.id <= last_id
+                ).distinct()
+                rows = rows.where(table.c.user_id.in_(changed))
+            session.execute(insert(ChipBalanceSnapshot.__table__).from_select(
+                ["user_id", "balance", "ledger_id", "created_at"], rows
+            ))
+            return last_id
+
+    def prune_balance_snapshots(self):
+        """Удалить снимки балансов, кроме последнего у каждого игрока (аудит берет только его); возвращает число строк"""
+        latest = select(func.max(ChipBalanceSnapshot.id)).group_by(ChipBalanceSnapshot.user_id)
+        with self.session_scope() as session:
+            return session.query(ChipBalanceSnapshot).filter(
+                ChipBalanceSnapshot.id.not_in(latest)
+            ).delete(synchronize_session=False)
+
+    def audit_chips(self, user_id):
+        """
+        Сверка баланса с журналом: последний снимок + движения после него
+        Возвращает {"expected", "actual", "ok"} или None, если игрока нет
+        """
+        with self.session_scope() as session:
+            actual = session.query(PlayerProfile.chips).filter_by(user_id=user_id).scalar()
+            if actual is None:
+                return None
+            snapshot = session.query(ChipBalanceSnapshot).filter_by(user_id=user_id).order_by(
+                ChipBalanceSnapshot.ledger_id.desc()
+            ).first()
+            base, after = (snapshot.balance, snapshot.ledger_id) if snapshot else (0, 0)
+            moved = session.query(func.coalesce(func.sum(ChipLedger.delta), 0)).filter(
+                ChipLedger.user_id == user_id, ChipLedger.id > after
+            ).scalar()
+            expected = base + moved
+            return {"expected": expected, "actual": actual, "ok": expected == actual}
+
+    def _ensure_ratings(self):
+        """Один раз загрузить рейтинги всех игроков в RatingIndex"""
+        if self.ratings.loaded:
+            return
+        with self.ratings._lock:
+            if self.ratings.loaded:
+                return
+            with self.session_scope() as session:
+                self.ratings.load(session.query(PlayerProfile.user_id, PlayerProfile.rating).all())
 
     def get_leaderboard(self, limit=10):
         """Получить таблицу лидеров"""
-        return self.session.query(PlayerProfile).order_by(
-            PlayerProfile.rating.desc()
-        ).limit(limit).all()
+        if limit > self.ratings.top_size:
+            with self.session_scope() as session:
+                return session.query(PlayerProfile).order_by(
+                    PlayerProfile.rating.desc()
+                ).limit(limit).all()
+
+        # Порядок - из топа в памяти, профили - из кэша, недостающие одним запросом
+        self._ensure_ratings()
+        user_ids = self.ratings.top(limit)
+        profiles = {}
+        missing = []
+        for user_id in user_ids:
+            profile = self.cache.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                profiles[user_id] = profile
+        if missing:
+            with self.session_scope() as session:
+                for profile in session.query(PlayerProfile).filter(PlayerProfile.user_id.in_(missing)):
+                    profiles[profile.user_id] = profile
+                    self._after_commit(session, self.cache.put, profile)
+        return [profiles[user_id] for user_id in user_ids if user_id in profiles]
+
+    def get_player_rank(self, user_id):
+        """Место игрока по рейтингу: (место, всего игроков) или None"""
+        self._ensure_ratings()
+        return self.ratings.rank(user_id)
 
     # ========== Игровые столы ==========
 
     def create_table(self, chat_id, creator_id, small_blind=10, big_blind=20,
                     min_buy_in=100, max_buy_in=10000, max_players=9):
         """Создать новый игровой стол"""
-        table = GameTable(
-            chat_id=chat_id,
-            creator_id=creator_id,
-            small_blind=small_blind,
-            big_blind=big_blind,
-            min_buy_in=min_buy_in,
-            max_buy_in=max_buy_in,
-            max_players=max_players,
-            status="waiting"
-        )
-        self.session.add(table)
-        self.session.commit()
-        return table
+        with self.session_scope() as session:
+            table = GameTable(
+                chat_id=chat_id,
+                creator_id=creator_id,
+                small_blind=small_blind,
+                big_blind=big_blind,
+                min_buy_in=min_buy_in,
+                max_buy_in=max_buy_in,
+                max_players=max_players,
+                status="waiting"
+            )
+            session.add(table)
+            session.flush()
+            return table
 
     def get_table(self, table_id):
         """Получить стол по ID"""
-        return self.session.query(GameTable).filter_by(id=table_id).first()
+        with self.session_scope() as session:
+            return session.query(GameTable).filter_by(id=table_id).first()
 
     def get_active_tables(self, chat_id):
         """Получить активные столы в чате"""
-        return self.session.query(GameTable).filter_by(
-            chat_id=chat_id,
-            status__in=["waiting", "playing"]
-        ).all()
+        with self.session_scope() as session:
+            return session.query(GameTable).filter(
+                GameTable.chat_id == chat_id,
+                GameTable.status.in_(["waiting", "playing"])
+            ).all()
+
+    def get_unfinished_tables(self):
+        """Все незавершенные столы с сохраненным состоянием - одним запросом"""
+        with self.session_scope() as session:
+            return session.query(GameTable).filter(
+                GameTable.status.in_(["waiting", "playing"]),
+                GameTable.game_state.isnot(None)
+            ).all()
 
     def update_table_state(self, table_id, game_state):
         """Обновить состояние игры"""
-        table = self.get_table(table_id)
-        if table:
-            table.game_state = game_state
-            table.current_stage = game_state.get("stage")
-            table.pot = game_state.get("pot", 0)
-            table.community_cards = game_state.get("community_cards", [])
-            self.session.commit()
-            return True
-        return False
+        with self.session_scope() as session:
+            table = session.query(GameTable).filter_by(id=table_id).first()
+            if table:
+                table.game_state = game_state
+                table.current_stage = game_state.get("stage")
+                table.pot = game_state.get("pot", 0)
+                table.community_cards = game_state.get("community_cards", [])
+                return True
+            return False
+
+    def patch_table_states(self, updates):
+        """
+        Применить изменения состояния нескольких столов одной транзакцией
+        updates: [{"table_id", "patch", "stage", "pot", "community_cards", "status"}],
+        patch - JSON Merge Patch к game_state
+        """
+        if not updates:
+            return
+
+        with self.session_scope() as session:
+            if self.engine.dialect.name == "sqlite":
+                # Патч применяет сама база, состояние целиком не передается
+                table = GameTable.__table__
+                statement = update(table).where(table.c.id == bindparam("b_table_id")).values(
+                    game_state=func.json_patch(table.c.game_state, bindparam("b_patch")),
+                    current_stage=bindparam("b_stage"),
+                    pot=bindparam("b_pot"),
+                    community_cards=bindparam("b_community_cards", type_=JSON),
+                    status=bindparam("b_status"),
+                )
+                session.execute(statement, [
+                    {
+                        "b_table_id": u["table_id"],
+                        "b_patch": json.dumps(u["patch"]),
+                        "b_stage": u["stage"],
+                        "b_pot": u["pot"],
+                        "b_community_cards": u["community_cards"],
+                        "b_status": u["status"],
+                    }
+                    for u in updates
+                ])
+            else:
+                tables = {
+                    t.id: t for t in session.query(GameTable).filter(
+                        GameTable.id.in_([u["table_id"] for u in updates])
+                    )
+                }
+                for u in updates:
+                    table = tables.get(u["table_id"])
+                    if table:
+                        table.game_state = _merge_patch(table.game_state, u["patch"])
+                        table.current_stage = u["stage"]
+                        table.pot = u["pot"]
+                        table.community_cards = u["community_cards"]
+                        table.status = u["status"]
 
     def finish_table(self, table_id):
         """Завершить игру"""
-        table = self.get_table(table_id)
-        if table:
-            table.status = "finished"
-            table.finished_at = datetime.utcnow()
-            self.session.commit()
-            return True
-        return False
+        with self.session_scope() as session:
+            table = session.query(GameTable).filter_by(id=table_id).first()
+            if table:
+                table.status = "finished"
+                table.finished_at = datetime.utcnow()
+                return True
+            return False
+
+    def close_table(self, table_id, stacks):
+        """
+        Закрыть стол без расчета раздачи одной транзакцией: стеки stacks ({user_id: фишки})
+        возвращаются на балансы, стол помечается завершенным
+        """
+        with self.session_scope() as session:
+            for user_id, chips in stacks.items():
+                if chips:
+                    self._move_chips(session, PlayerProfile.user_id == user_id, chips, "table_cash_out")
+            session.query(GameTable).filter_by(id=table_id).update(
+                {"status": "finished", "finished_at": datetime.utcnow()}, synchronize_session=False
+            )
 
     # ========== Участие в играх ==========
 
     def join_table(self, table_id, player_id, buy_in):
         """Присоединиться к столу"""
-        # Проверяем, что игрок еще не за столом
-        existing = self.session.query(GameParticipation).filter_by(
-            table_id=table_id,
-            player_id=player_id,
-            is_active=True
-        ).first()
-
-        if existing:
-            return None
-
-        # Проверяем, что у игрока достаточно фишек
-        player = self.session.query(PlayerProfile).filter_by(id=player_id).first()
-        if not player or player.chips < buy_in:
-            return None
-
-        # Списываем фишки
-        player.chips -= buy_in
-
-        # Создаем участие
-        participation = GameParticipation(
-            table_id=table_id,
-            player_id=player_id,
-            buy_in=buy_in,
-            current_chips=buy_in
-        )
-        self.session.add(participation)
-        self.session.commit()
+        with self.session_scope() as session:
+            # Проверяем, что игрок еще не за столом
+            existing = session.query(GameParticipation).filter_by(
+                table_id=table_id,
+                player_id=player_id,
+                is_active=True
+            ).first()
+
+            if existing:
+                return None
+
+            # Списываем фишки, если их достаточно
+            if self._move_chips(session, PlayerProfile.id == player_id, -buy_in, "table_buy_in") is None:
+                return None
+
+            # Создаем участие
+            participation = GameParticipation(
+                table_id=table_id,
+                player_id=player_id,
+                buy_in=buy_in,
+                current_chips=buy_in
+            )
+            session.add(participation)
 
-        return participation
+            return participation
 
     def leave_table(self, table_id, player_id):
         """Покинуть стол"""
-        participation = self.session.query(GameParticipation).filter_by(
-            table_id=table_id,
-            player_id=player_id,
-            is_active=True
-        ).first()
-
-        if participation:
-            # Возвращаем оставшиеся фишки
-            player = self.session.query(PlayerProfile).filter_by(id=player_id).first()
-            if player:
-                player.chips += participation.current_chips
-
-            participation.is_active = False
-            self.session.commit()
-            return True
-        return False
+        with self.session_scope() as session:
+            participation = session.query(GameParticipation).filter_by(
+                table_id=table_id,
+                player_id=player_id,
+                is_active=True
+            ).first()
+
+            if participation:
+                # Возвращаем оставшиеся фишки
+                self._move_chips(session, PlayerProfile.id == player_id, participation.current_chips,
+                                 "table_cash_out")
+
+                participation.is_active = False
+                return True
+            return False
 
     def get_table_players(self, table_id):
         """Получить игроков за столом"""
-        participations = self.session.query(GameParticipation).filter_by(
-            table_id=table_id,
-            is_active=True
-        ).all()
-
-        players = []
-        for p in participations:
-            player = self.session.query(PlayerProfile).filter_by(id=p.player_id).first()
-            if player:
-                players.append({
+        with self.session_scope() as session:
+            rows = session.query(GameParticipation, PlayerProfile).join(
+                PlayerProfile, PlayerProfile.id == GameParticipation.player_id
+            ).filter(
+                GameParticipation.table_id == table_id,
+                GameParticipation.is_active == True  # noqa: E712
+            ).all()
+
+            return [
+                {
                     "user_id": player.user_id,
                     "name": player.full_name,
                     "chips": p.current_chips,
                     "buy_in": p.buy_in
-                })
-
-        return players
+                }
+                for p, player in rows
+            ]
 
     # ========== Статистика ==========
 
     def update_player_stats(self, user_id, won=False, winnings=0):
         """Обновить статистику игрока"""
-        player = self.session.query(PlayerProfile).filter_by(user_id=user_id).first()
-        if player:
-            player.total_games += 1
-            if won:
-                player.games_won += 1
-                player.total_winnings += winnings
-                # Увеличиваем рейтинг за победу
-                player.rating += 10
-            else:
-                # Немного уменьшаем рейтинг за поражение
-                player.rating = max(0, player.rating - 5)
-
-            self.session.commit()
-            return True
-        return False
+        with self.session_scope() as session:
+            player = session.query(PlayerProfile).filter_by(user_id=user_id).first()
+            if player:
+                player.total_games += 1
+                if won:
+                    player.games_won += 1
+                    player.total_winnings += winnings
+                    # Увеличиваем рейтинг за победу
+                    player.rating += RATING_WIN
+                else:
+                    # Немного уменьшаем рейтинг за поражение
+                    player.rating = max(0, player.rating + RATING_LOSS)
+                self._after_commit(session, self.cache.invalidate, user_id)
+                self._after_commit(session, self.ratings.set, user_id, player.rating)
+                return True
+            return False
+
+    def settle_hands(self, hands, finished_tables=()):
+        """
+        Итоги одной или нескольких раздач одной транзакцией, пакетными UPDATE
+        hands: [[{"user_id", "chips", "won", "winnings", "profit"}, ...], ...] - по списку участников на раздачу,
+        chips - сколько фишек вернуть на баланс (стек при выходе из-за стола),
+        profit - чистый результат раздачи для рейтинга Эло, истории и дневных итогов
+        finished_tables - id столов, которые закрываются вместе с этими итогами: стол помечается
+        завершенным только вместе с возвратом стеков, иначе после падения фишки потеряются
+        """
+        hands = [results for results in hands if results]
+        if not hands and not finished_tables:
+            return
+
+        table = PlayerProfile.__table__
+        statement = update(table).where(table.c.user_id == bindparam("b_user_id")).values(
+            chips=table.c.chips + bindparam("b_chips"),
+            total_games=table.c.total_games + 1,
+            games_won=table.c.games_won + bindparam("b_won"),
+            total_winnings=table.c.total_winnings + bindparam("b_winnings"),
+        )
+        # Возврат стека в журнал фишек - с балансом, который получился после UPDATE
+        ledger = insert(ChipLedger.__table__).from_select(
+            ["user_id", "delta", "balance", "reason", "created_at"],
+            select(table.c.user_id, bindparam("b_chips"), table.c.chips, literal("table_cash_out"),
+                   literal(datetime.utcnow())).where(table.c.user_id == bindparam("b_user_id"))
+        )
+        with self.session_scope() as session:
+            # По раздаче за раз, чтобы баланс в журнале был после своей раздачи
+            for results in hands:
+                rows = [
+                    {
+                        "b_user_id": r["user_id"],
+                        "b_chips": r["chips"],
+                        "b_won": 1 if r["won"] else 0,
+                        "b_winnings": r["winnings"] if r["won"] else 0,
+                    }
+                    for r in results
+                ]
+                session.execute(statement, rows)
+                moved = [row for row in rows if row["b_chips"]]
+                if moved:
+                    session.execute(ledger, moved)
+                # Новые значения посчитала база - закэшированные профили просто сбрасываем
+                for row in rows:
+                    self._after_commit(session, self.cache.invalidate, row["b_user_id"])
+
+            if hands:
+                self._update_ratings(session, hands)
+                self._add_game_history(session, hands)
+                self._add_daily_stats(session, hands)
+
+            if finished_tables:
+                session.query(GameTable).filter(GameTable.id.in_(finished_tables)).update(
+                    {"status": "finished", "finished_at": datetime.utcnow()}, synchronize_session=False
+                )
+
+    def _update_ratings(self, session, hands):
+        """Эло по раздачам пачки по порядку; рейтинги читаются уже под блокировкой записи"""
+        user_ids = {r["user_id"] for results in hands for r in results}
+        ratings = dict(session.query(PlayerProfile.user_id, PlayerProfile.rating).filter(
+            PlayerProfile.user_id.in_(user_ids)
+        ))
+        for results in hands:
+            apply_hand(ratings, [r["user_id"] for r in results], [r.get("profit", 0) for r in results])
+
+        table = PlayerProfile.__table__
+        session.execute(
+            update(table).where(table.c.user_id == bindparam("b_user_id")).values(rating=bindparam("b_rating")),
+            [{"b_user_id": user_id, "b_rating": rating} for user_id, rating in ratings.items()]
+        )
+        for user_id, rating in ratings.items():
+            self._after_commit(session, self.ratings.set, user_id, rating)
+
+    def _add_game_history(self, session, hands):
+        """Строка game_history и строки участников на каждую раздачу"""
+        histories = []
+        for results in hands:
+            winners = [r["user_id"] for r in results if r["won"]]
+            history = GameHistory(pot_size=sum(r["winnings"] for r in results), players_count=len(results))
+            if winners:
+                history.winner_id = select(PlayerProfile.id).where(
+                    PlayerProfile.user_id == winners[0]
+                ).scalar_subquery()
+            histories.append(history)
+        session.add_all(histories)
+        session.flush()
+
+        session.execute(insert(GameHistoryParticipant.__table__), [
+            {"history_id": history.id, "user_id": r["user_id"], "profit": r.get("profit", 0), "won": r["won"]}
+            for history, results in zip(histories, hands) for r in results
+        ])
+
+    def _upsert_increment(self, session, table, keys, rows):
+        """
+        Прибавить счетчики строк rows ({колонка: значение}) к строкам с теми же keys,
+        недостающие строки создать. Один пакетный upsert, где база умеет ON CONFLICT
+        """
+        if not rows:
+            return
+        counters = [name for name in rows[0] if name not in keys]
+
+        dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(self.engine.dialect.name)
+        if dialect is not None:
+            statement = dialect.insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={name: table.c[name] + statement.excluded[name] for name in counters},
+            )
+            session.execute(statement, rows)
+            return
+
+        # Без ON CONFLICT: обновляем, а кого не нашли - вставляем
+        updated = update(table).where(
+            *[table.c[name] == bindparam(f"b_{name}") for name in keys]
+        ).values({name: table.c[name] + bindparam(f"b_{name}") for name in counters})
+        for row in rows:
+            if session.execute(updated, {f"b_{name}": value for name, value in row.items()}).rowcount == 0:
+                session.execute(insert(table), row)
+
+    def _add_daily_stats(self, session, hands):
+        """Прибавить раздачи к дневным итогам: одна строка на игрока за пачку"""
+        today = datetime.utcnow().date()
+        totals = {}
+        for results in hands:
+            for r in results:
+                row = totals.setdefault(r["user_id"], {"user_id": r["user_id"], "day": today,
+                                                       "chips_won": 0, "hands": 0, "wins": 0})
+                row["chips_won"] += r.get("profit", 0)
+                row["hands"] += 1
+                row["wins"] += 1 if r["won"] else 0
+        self._upsert_increment(session, PlayerDailyStats.__table__, ["user_id", "day"], list(totals.values()))
+
+    def get_window_leaderboard(self, window="day", limit=10):
+        """
+        Лучшие по чистому выигрышу за окно (day/week/month): сумма нескольких дневных строк
+        Возвращает [{"user_id", "name", "chips_won", "hands", "wins"}]
+        """
+        since = datetime.utcnow().date() - timedelta(days=STATS_WINDOWS[window] - 1)
+        chips_won = func.sum(PlayerDailyStats.chips_won).label("chips_won")
+        with self.session_scope() as session:
+            rows = session.query(
+                PlayerDailyStats.user_id,
+                PlayerProfile.full_name,
+                chips_won,
+                func.sum(PlayerDailyStats.hands),
+                func.sum(PlayerDailyStats.wins),
+            ).join(
+                PlayerProfile, PlayerProfile.user_id == PlayerDailyStats.user_id
+            ).filter(
+                PlayerDailyStats.day >= since
+            ).group_by(
+                PlayerDailyStats.user_id, PlayerProfile.full_name
+            ).order_by(chips_won.desc()).limit(limit).all()
+
+            return [
+                {"user_id": user_id, "name": name, "chips_won": won, "hands": hands, "wins": wins}
+                for user_id, name, won, hands, wins in rows
+            ]
+
+    def prune_daily_stats(self, keep_days=DAILY_STATS_KEEP_DAYS):
+        """Удалить дневные итоги, которые не попадают ни в одно окно; возвращает число строк"""
+        before = datetime.utcnow().date() - timedelta(days=keep_days)
+        with self.session_scope() as session:
+            return session.query(PlayerDailyStats).filter(
+                PlayerDailyStats.day < before
+            ).delete(synchronize_session=False)
+
+    def add_style_stats(self, deltas):
+        """Прибавить счетчики стиля игры: deltas - {user_id: {"hands", "vpip", ...}}"""
+        rows = [{"user_id": user_id, **counters} for user_id, counters in deltas.items()]
+        with self.session_scope() as session:
+            self._upsert_increment(session, PlayerStyleStats.__table__, ["user_id"], rows)
+
+    def get_style_stats(self, user_id):
+        """Счетчики стиля игры игрока (dict) или None"""
+        with self.session_scope() as session:
+            stats = session.get(PlayerStyleStats, user_id)
+            if stats is None:
+                return None
+            return {name: getattr(stats, name) for name in STYLE_COUNTERS}
+
+    def settle_hand(self, results):
+        """Итоги одной раздачи: фишки и статистика всех участников"""
+        self.settle_hands([results])
 
     # ========== Турниры ==========
 
     def create_tournament(self, chat_id, creator_id, name, buy_in=100,
                          starting_chips=1000, max_players=18):
         """Создать турнир"""
-        tournament = Tournament(
-            chat_id=chat_id,
-            creator_id=creator_id,
-            name=name,
-            buy_in=buy_in,
-            starting_chips=starting_chips,
-            max_players=max_players
-        )
-        self.session.add(tournament)
-        self.session.commit()
-        return tournament
+        with self.session_scope() as session:
+            tournament = Tournament(
+                chat_id=chat_id,
+                creator_id=creator_id,
+                name=name,
+                buy_in=buy_in,
+                starting_chips=starting_chips,
+                max_players=max_players
+            )
+            session.add(tournament)
+            session.flush()
+            return tournament
 
     def get_tournament(self, tournament_id):
         """Получить турнир"""
-        return self.session.query(Tournament).filter_by(id=tournament_id).first()
+        with self.session_scope() as session:
+            return session.query(Tournament).filter_by(id=tournament_id).first()
 
     def join_tournament(self, tournament_id, player_id):
         """Присоединиться к турниру"""
-        tournament = self.get_tournament(tournament_id)
-        if not tournament or tournament.status != "registration":
-            return None
-
-        # Проверяем, что игрок еще не зарегистрирован
-        existing = self.session.query(TournamentParticipation).filter_by(
-            tournament_id=tournament_id,
-            player_id=player_id
-        ).first()
-
-        if existing:
-            return None
-
-        # Проверяем фишки игрока
-        player = self.session.query(PlayerProfile).filter_by(id=player_id).first()
-        if not player or player.chips < tournament.buy_in:
-            return None
-
-        # Списываем бай-ин
-        player.chips -= tournament.buy_in
-        tournament.prize_pool += tournament.buy_in
-
-        # Регистрируем участие
-        participation = TournamentParticipation(
-            tournament_id=tournament_id,
-            player_id=player_id,
-            chips=tournament.starting_chips
-        )
-        self.session.add(participation)
-        self.session.commit()
+        with self.session_scope() as session:
+            tournament = session.query(Tournament).filter_by(id=tournament_id).first()
+            if not tournament or tournament.status != "registration":
+                return None
+
+            # Проверяем, что игрок еще не зарегистрирован
+            existing = session.query(TournamentParticipation).filter_by(
+                tournament_id=tournament_id,
+                player_id=player_id
+            ).first()
+
+            if existing:
+                return None
+
+            # Списываем бай-ин, если хватает фишек
+            if self._move_chips(session, PlayerProfile.id == player_id, -tournament.buy_in,
+                                "tournament_buy_in") is None:
+                return None
+            session.execute(
+                update(Tournament).where(Tournament.id == tournament_id)
+                .values(prize_pool=Tournament.prize_pool + tournament.buy_in)
+            )
 
-        return participation
+            # Регистрируем участие
+            participation = TournamentParticipation(
+                tournament_id=tournament_id,
+                player_id=player_id,
+                chips=tournament.starting_chips
+            )
+            session.add(participation)
+
+            return participation
+
+
+class AsyncDatabase:
+    """
+    Неблокирующая обертка над Database для async-обработчиков
+    Те же методы, но каждый вызов - awaitable и выполняется в потоке базы.
+    По умолчанию поток один: вызовы идут в порядке постановки (на это полагается
+    TableStore), а SQLite все равно пишет по одному. Для серверной базы можно больше workers
+    """
+
+    def __init__(self, database: Database, workers: int = 1):
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="database")
+
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+
+        @wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(method, *args, **kwargs))
+
+        setattr(self, name, call)
+        return call
+
+    def submit(self, name, *args, **kwargs) -> Future:
+        """Поставить вызов в очередь потока базы без ожидания (порядок вызовов сохраняется)"""
+        return self.executor.submit(getattr(self.database, name), *args, **kwargs)
+
+    def close(self):
+        """Дождаться уже поставленных вызовов и остановить поток"""
+        self.executor.shutdown(wait=True)
+
+
+class SettlementBuffer:
+    """
+    Отложенная запись итогов раздач: завершенные раздачи копятся и пишутся
+    одной транзакцией через max_delay секунд или при накоплении max_hands
+    """
+
+    def __init__(self, db: AsyncDatabase, max_hands: int = 16, max_delay: float = 0.5):
+        self.db = db
+        self.max_hands = max_hands
+        self.max_delay = max_delay
+        self._hands = []
+        self._tables = []
+        self._timer = None
+
+    def add(self, results, table_id=None):
+        """Итоги раздачи; table_id - стол, который закрывается в той же транзакции"""
+        self._hands.append(results)
+        if table_id is not None:
+            self._tables.append(table_id)
+        if len(self._hands) >= self.max_hands:
+            self.flush()
+        elif self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            self._timer = loop.call_later(self.max_delay, self.flush)
+
+    def flush(self) -> Future:
+        """Поставить накопленные раздачи в очередь потока базы"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        hands, self._hands = self._hands, []
+        tables, self._tables = self._tables, []
+        future = self.db.submit("settle_hands", hands, tables)
+        future.add_done_callback(_log_settlement_error)
+        return future
+
+
+def _log_settlement_error(future: Future):
+    if future.exception() is not None:
+        logger.error("Не удалось записать итоги раздач", exc_info=future.exception())
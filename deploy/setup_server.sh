@@ -54,7 +54,7 @@ echo "⚙️ Создание конфигурационного файла..."
 read -p "Введите BOT_TOKEN от @BotFather: " BOT_TOKEN
 cat > .env << EOF
 BOT_TOKEN=$BOT_TOKEN
-DATABASE_URL=poker_club.db
+DATABASE_URL=poker_game.db
 EOF
 
 # Создаем systemd service
@@ -0,0 +1,211 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import combinations
+from typing import List, Optional
+
+import numpy as np
+
+from poker_engine import Card, PokerHandEvaluator
+
+# Размер пачки бордов, которые оцениваются за один вызов winners_many
+BATCH_SIZE = 4096
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """Пул процессов создается один раз и переиспользуется между запросами"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+
+def shutdown_pool():
+    """Остановить пул процессов (при завершении бота)"""
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        _executor_workers = 0
+
+
+def _validate(hands: List[List[Card]], community_cards: List[Card], dead_cards: List[Card]):
+    """Проверка входных данных, возвращает (карты игроков, борд, оставшаяся колода) в кодах"""
+    if not 2 <= len(hands) <= 9:
+        raise ValueError("Equity needs 2-9 players")
+    if any(len(hand) != 2 for hand in hands):
+        raise ValueError("Each player needs exactly 2 hole cards")
+    if len(community_cards) > 5:
+        raise ValueError("Board can't have more than 5 cards")
+
+    hole_codes = [[card.code for card in hand] for hand in hands]
+    board_codes = [card.code for card in community_cards]
+    used = [code for hand in hole_codes for code in hand] + board_codes + [card.code for card in dead_cards]
+    if len(set(used)) != len(used):
+        raise ValueError("Duplicate cards")
+
+    used_set = set(used)
+    remaining = [code for code in range(52) if code not in used_set]
+    if len(remaining) < 5 - len(board_codes):
+        raise ValueError("Not enough cards left to complete the board")
+    return hole_codes, board_codes, remaining
+
+
+def _simulate(hole_codes, board_codes, remaining, iterations, time_budget, seed_sequence):
+    """
+    Воркер: разыгрывает случайные доски и считает победы/дележи
+    Останавливается по числу итераций или по истечении time_budget секунд
+    """
+    rng = np.random.default_rng(seed_sequence)
+    players = len(hole_codes)
+    holes = np.array(hole_codes, dtype=np.intp)
+    board = np.array(board_codes, dtype=np.intp)
+    deck = np.array(remaining, dtype=np.intp)
+    missing = 5 - len(board_codes)
+
+    wins = np.zeros(players, dtype=np.int64)
+    ties = np.zeros(players, dtype=np.int64)
+    shares = np.zeros(players, dtype=np.float64)
+    trials = 0
+
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+    while True:
+        if iterations is not None:
+            batch = min(BATCH_SIZE, iterations - trials)
+            if batch <= 0:
+                break
+        else:
+            batch = BATCH_SIZE
+        if deadline is not None and trials and time.monotonic() >= deadline:
+            break
+
+        if missing:
+            # Случайная выборка без повторений: первые missing карт случайной перестановки колоды
+            picks = np.argpartition(rng.random((batch, len(deck))), missing, axis=1)[:, :missing]
+            boards = np.concatenate([np.broadcast_to(board, (batch, len(board))), deck[picks]], axis=1)
+        else:
+            # Борд полный - результат не случаен, достаточно одной оценки
+            batch = 1
+            boards = board[None, :]
+
+        winners = PokerHandEvaluator.winners_many(holes, boards)
+        winner_counts = winners.sum(axis=1)
+        single = winner_counts == 1
+        wins += winners[single].sum(axis=0)
+        ties += winners[~single].sum(axis=0)
+        shares += (winners / winner_counts[:, None]).sum(axis=0)
+        trials += batch
+
+        if not missing:
+            break
+
+    return wins, ties, shares, trials
+
+
+def calculate_equity(hands: List[List[Card]], community_cards: Optional[List[Card]] = None,
+                     dead_cards: Optional[List[Card]] = None, iterations: Optional[int] = 20000,
+                     time_budget: Optional[float] = None, workers: Optional[int] = None,
+                     seed: Optional[int] = None) -> List[dict]:
+    """
+    Оценка эквити методом Монте-Карло
+    hands: карты 2-9 игроков, community_cards: открытая часть борда, dead_cards: вышедшие из игры карты
+    Бюджет - число итераций и/или время в секундах; работа делится между процессами пула,
+    у каждого свой независимый поток случайных чисел
+    Возвращает для каждого игрока {"win", "tie", "equity"} в долях от 0 до 1
+    """
+    community_cards = community_cards or []
+    dead_cards = dead_cards or []
+    if iterations is None and time_budget is None:
+        raise ValueError("Need an iteration or time budget")
+
+    hole_codes, board_codes, remaining = _validate(hands, community_cards, dead_cards)
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+
+    if iterations is not None:
+        per_worker = [iterations // workers + (1 if i < iterations % workers else 0) for i in range(workers)]
+    else:
+        per_worker = [None] * workers
+
+    jobs = [
+        (hole_codes, board_codes, remaining, per_worker[i], time_budget, seeds[i])
+        for i in range(workers)
+        if per_worker[i] is None or per_worker[i] > 0
+    ]
+
+    if len(jobs) == 1:
+        results = [_simulate(*jobs[0])]
+    else:
+        executor = _get_executor(workers)
+        futures = [executor.submit(_simulate, *job) for job in jobs]
+        results = [future.result() for future in futures]
+
+    wins = sum(r[0] for r in results)
+    ties = sum(r[1] for r in results)
+    shares = sum(r[2] for r in results)
+    trials = sum(r[3] for r in results)
+
+    return [
+        {
+            "win": float(wins[i]) / trials,
+            "tie": float(ties[i]) / trials,
+            "equity": float(shares[i]) / trials,
+        }
+        for i in range(len(hands))
+    ]
+
+
+@lru_cache(maxsize=4096)
+def _exact_equity_codes(hole_codes: tuple, board_codes: tuple, dead_codes: tuple) -> tuple:
+    """
+    Полный перебор оставшихся карт борда для канонического ключа (борд и мертвые карты отсортированы)
+    Каждая доска оценивается один раз для всех игроков сразу
+    """
+    used = set(board_codes) | set(dead_codes) | {code for hand in hole_codes for code in hand}
+    remaining = [code for code in range(52) if code not in used]
+    missing = 5 - len(board_codes)
+
+    runouts = np.array(list(combinations(remaining, missing)), dtype=np.intp).reshape(-1, missing)
+    boards = np.concatenate([np.broadcast_to(np.array(board_codes, dtype=np.intp), (len(runouts), len(board_codes))),
+                             runouts], axis=1)
+
+    winners = PokerHandEvaluator.winners_many(np.array(hole_codes, dtype=np.intp), boards)
+    winner_counts = winners.sum(axis=1)
+    single = winner_counts == 1
+    wins = winners[single].sum(axis=0)
+    ties = winners[~single].sum(axis=0)
+    shares = (winners / winner_counts[:, None]).sum(axis=0)
+    total = len(boards)
+
+    return tuple(
+        (float(wins[i]) / total, float(ties[i]) / total, float(shares[i]) / total)
+        for i in range(len(hole_codes))
+    )
+
+
+def exact_equity(hands: List[List[Card]], community_cards: Optional[List[Card]] = None,
+                 dead_cards: Optional[List[Card]] = None) -> List[dict]:
+    """
+    Точное эквити перебором всех раскладов терна/ривера (на флопе до 990 досок, на терне до 44)
+    Результат для одного и того же борда кешируется
+    Возвращает для каждого игрока {"win", "tie", "equity"} в долях от 0 до 1
+    """
+    community_cards = community_cards or []
+    dead_cards = dead_cards or []
+    hole_codes, board_codes, _ = _validate(hands, community_cards, dead_cards)
+
+    key_holes = tuple(tuple(sorted(hand)) for hand in hole_codes)
+    key_board = tuple(sorted(board_codes))
+    key_dead = tuple(sorted(card.code for card in dead_cards))
+
+    return [
+        {"win": win, "tie": tie, "equity": share}
+        for win, tie, share in _exact_equity_codes(key_holes, key_board, key_dead)
+    ]
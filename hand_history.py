@@ -0,0 +1,339 @@
+"""
+Компактная бинарная история раздач
+
+Запись = varint длины + тело. Тело:
+    версия (1 байт), время (varint), game_id (строка), блайнды (varint x2), дилер (1 байт),
+    места: количество (1 байт) и для каждого user_id (zigzag varint), имя (строка),
+           стек до блайндов (varint), 2 карманные карты (коды, 255 - нет карты),
+    борд: количество (1 байт) + коды,
+    действия: количество (varint) и для каждого место (1 байт), код действия (1 байт), сумма (varint),
+    выплаты: количество (1 байт) и для каждой место (1 байт), сумма (varint)
+Строка = varint длины + UTF-8.
+
+Записи дописываются в сегменты hands-000001.bin, hands-000002.bin, ... в одной папке.
+Недописанный при падении хвост последнего сегмента обрезается при открытии писателя.
+Читатель iter_hands отдает записи по одной, не загружая файлы целиком;
+iter_positions и read_hand - для чтения отдельной записи по ее месту в сегменте.
+"""
+import os
+import time
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from poker_engine import GameListener, PokerGame, ShowdownResult
+
+FORMAT_VERSION = 1
+NO_CARD = 255
+SEGMENT_PREFIX = "hands-"
+SEGMENT_SUFFIX = ".bin"
+
+ACTION_CODES = {"fold": 0, "check": 1, "call": 2, "raise": 3, "all_in": 4}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+
+
+# ========== Кодирование ==========
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_string(out: bytearray, text: str):
+    data = text.encode("utf-8")
+    _write_varint(out, len(data))
+    out += data
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+class _Cursor:
+    """Чтение тела одной записи"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def byte(self) -> int:
+        value = self.data[self.position]
+        self.position += 1
+        return value
+
+    def varint(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def string(self) -> str:
+        length = self.varint()
+        text = self.data[self.position:self.position + length].decode("utf-8")
+        self.position += length
+        return text
+
+
+class HandRecord:
+    """Одна раздача из истории"""
+    __slots__ = ("timestamp", "game_id", "small_blind", "big_blind", "dealer_position",
+                 "seats", "board", "actions", "payouts")
+
+    def __init__(self, timestamp: int, game_id: str, small_blind: int, big_blind: int, dealer_position: int,
+                 seats: List[dict], board: List[int], actions: List[Tuple[int, str, int]],
+                 payouts: List[Tuple[int, int]]):
+        self.timestamp = timestamp
+        self.game_id = game_id
+        self.small_blind = small_blind
+        self.big_blind = big_blind
+        self.dealer_position = dealer_position
+        self.seats = seats  # [{"user_id", "name", "stack", "hand": [коды]}]
+        self.board = board
+        self.actions = actions  # [(место, действие, сумма)]
+        self.payouts = payouts  # [(место, сумма)]
+
+    def encode(self) -> bytes:
+        out = bytearray()
+        out.append(FORMAT_VERSION)
+        _write_varint(out, self.timestamp)
+        _write_string(out, self.game_id)
+        _write_varint(out, self.small_blind)
+        _write_varint(out, self.big_blind)
+        out.append(self.dealer_position)
+
+        out.append(len(self.seats))
+        for seat in self.seats:
+            _write_varint(out, _zigzag(seat["user_id"]))
+            _write_string(out, seat["name"])
+            _write_varint(out, seat["stack"])
+            hand = list(seat["hand"]) + [NO_CARD] * (2 - len(seat["hand"]))
+            out += bytes(hand)
+
+        out.append(len(self.board))
+        out += bytes(self.board)
+
+        _write_varint(out, len(self.actions))
+        for seat, action, amount in self.actions:
+            out.append(seat)
+            out.append(ACTION_CODES[action])
+            _write_varint(out, amount)
+
+        out.append(len(self.payouts))
+        for seat, amount in self.payouts:
+            out.append(seat)
+            _write_varint(out, amount)
+        return bytes(out)
+
+    @staticmethod
+    def decode(data: bytes) -> "HandRecord":
+        cursor = _Cursor(data)
+        version = cursor.byte()
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported hand history version: {version}")
+
+        timestamp = cursor.varint()
+        game_id = cursor.string()
+        small_blind = cursor.varint()
+        big_blind = cursor.varint()
+        dealer_position = cursor.byte()
+
+        seats = []
+        for _ in range(cursor.byte()):
+            user_id = _unzigzag(cursor.varint())
+            name = cursor.string()
+            stack = cursor.varint()
+            hand = [code for code in (cursor.byte(), cursor.byte()) if code != NO_CARD]
+            seats.append({"user_id": user_id, "name": name, "stack": stack, "hand": hand})
+
+        board = [cursor.byte() for _ in range(cursor.byte())]
+        actions = [
+            (cursor.byte(), ACTION_NAMES[cursor.byte()], cursor.varint())
+            for _ in range(cursor.varint())
+        ]
+        payouts = [(cursor.byte(), cursor.varint()) for _ in range(cursor.byte())]
+        return HandRecord(timestamp, game_id, small_blind, big_blind, dealer_position,
+                          seats, board, actions, payouts)
+
+
+# ========== Запись ==========
+
+class HandHistoryWriter:
+    """Дописывает записи в сегменты; новый сегмент начинается, когда текущий больше segment_size"""
+
+    def __init__(self, directory: str, segment_size: int = 8 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        segments = _segment_paths(directory)
+        self._segment_index = _segment_number(segments[-1]) if segments else 1
+        self._file: Optional[BinaryIO] = None
+        if segments:
+            _truncate_torn_tail(segments[-1])
+
+    def _open(self) -> BinaryIO:
+        if self._file is None:
+            path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._segment_index:06d}{SEGMENT_SUFFIX}")
+            self._file = open(path, "ab")
+        elif self._file.tell() >= self.segment_size:
+            self._file.close()
+            self._segment_index += 1
+            self._file = None
+            return self._open()
+        return self._file
+
+    def write(self, record: HandRecord):
+        payload = record.encode()
+        frame = bytearray()
+        _write_varint(frame, len(payload))
+        frame += payload
+
+        f = self._open()
+        f.write(frame)
+        f.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HandHistoryRecorder(GameListener):
+    """Собирает раздачу из событий PokerGame и пишет ее после вскрытия"""
+
+    def __init__(self, writer: HandHistoryWriter):
+        self.writer = writer
+        self._record: Optional[HandRecord] = None
+
+    def on_hand_start(self, game: PokerGame):
+        self._record = HandRecord(
+            timestamp=int(time.time()),
+            game_id=str(game.game_id),
+            small_blind=game.small_blind,
+            big_blind=game.big_blind,
+            dealer_position=game.dealer_position,
+            # Стек до блайндов = фишки + уже поставленное
+            seats=[
+                {
+                    "user_id": p.user_id,
+                    "name": p.name,
+                    "stack": p.chips + p.total_bet,
+                    "hand": [card.code for card in p.hand],
+                }
+                for p in game.players
+            ],
+            board=[],
+            actions=[],
+            payouts=[],
+        )
+
+    def on_action(self, game: PokerGame, seat: int, action: str, amount: int):
+        if self._record is not None:
+            self._record.actions.append((seat, action, amount))
+
+    def on_showdown(self, game: PokerGame, result: ShowdownResult):
+        record = self._record
+        if record is None:
+            return
+        seat_of = {p.user_id: i for i, p in enumerate(game.players)}
+        record.board = [card.code for card in game.community_cards]
+        record.payouts = [(seat_of[user_id], amount) for user_id, amount in result.payouts.items()]
+        self.writer.write(record)
+        self._record = None
+
+
+# ========== Чтение ==========
+
+def _segment_paths(directory: str) -> List[str]:
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def _segment_number(path: str) -> int:
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def _read_varint(f: BinaryIO) -> Optional[int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            if shift:
+                raise ValueError("Truncated hand history record")
+            return None
+        result |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def _truncate_torn_tail(path: str):
+    """Обрезать сегмент после последней целой записи - хвост, недописанный при падении"""
+    end = 0
+    with open(path, "rb") as f:
+        while True:
+            try:
+                length = _read_varint(f)
+                if length is None:
+                    break
+                payload = f.read(length)
+                if len(payload) != length:
+                    break
+                HandRecord.decode(payload)
+            except (ValueError, IndexError, KeyError, UnicodeDecodeError):
+                break
+            end = f.tell()
+    if end < os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+
+
+def iter_positions(path: str) -> Iterator[Tuple[str, int, HandRecord]]:
+    """Потоковое чтение с местом каждой записи: (файл сегмента, смещение кадра, запись)"""
+    paths = _segment_paths(path) if os.path.isdir(path) else [path]
+    for number, segment in enumerate(paths):
+        with open(segment, "rb") as f:
+            while True:
+                offset = f.tell()
+                try:
+                    length = _read_varint(f)
+                except ValueError:
+                    length = -1
+                if length is None:
+                    break
+                payload = f.read(length) if length >= 0 else b""
+                if len(payload) != length:
+                    if number == len(paths) - 1 and not f.read(1):
+                        # Недописанная последняя запись: писатель упал, при следующем запуске он ее обрежет
+                        break
+                    raise ValueError(f"Truncated hand history record in {segment}")
+                yield segment, offset, HandRecord.decode(payload)
+
+
+def iter_hands(path: str) -> Iterator[HandRecord]:
+    """Потоковое чтение раздач из файла сегмента или из папки со всеми сегментами по порядку"""
+    for _, _, record in iter_positions(path):
+        yield record
+
+
+def read_hand(segment: str, offset: int) -> HandRecord:
+    """Одна запись по месту из iter_positions"""
+    with open(segment, "rb") as f:
+        f.seek(offset)
+        length = _read_varint(f)
+        payload = f.read(length) if length is not None else b""
+        if length is None or len(payload) != length:
+            raise ValueError(f"Truncated hand history record in {segment}")
+        return HandRecord.decode(payload)
@@ -0,0 +1,264 @@
+"""
+Журнал действий (write-ahead log) для восстановления столов после падения
+
+Каждое принятое действие, посадка за стол и начало раздачи (с порядком колоды)
+дописываются строкой JSON с номером записи (LSN) в сегменты journal-000001.log, ...
+Фоновый поток сбрасывает записи на диск пачками: раз в flush_interval секунд
+или при накоплении batch_size записей, один fsync на пачку.
+
+Снимок стола в game_tables хранит journal_lsn - последнюю запись, которая в нем уже
+учтена. При старте записи после journal_lsn применяются поверх снимка.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from poker_engine import _CARDS, Deck, GameListener, PokerGame
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+
+
+def _segment_paths(directory: str) -> List[str]:
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def _read_segment(path: str) -> Iterator[dict]:
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if record is not None and line.endswith(b"\n"):
+                yield record
+            elif not line.endswith(b"\n"):
+                # Недописанная при падении последняя строка
+                logger.warning("Обрезанная запись в журнале %s", path)
+            else:
+                logger.error("Испорченная запись в журнале %s пропущена", path)
+
+
+def _truncate_torn_tail(path: str):
+    """Обрезать сегмент после последней целой строки, чтобы новые записи не легли за обрывком"""
+    end = 0
+    position = 0
+    with open(path, "rb") as f:
+        for line in f:
+            position += len(line)
+            if not line.endswith(b"\n"):
+                break
+            try:
+                json.loads(line)
+            except ValueError:
+                continue
+            end = position
+    if end < os.path.getsize(path):
+        logger.warning("Журнал %s обрезан до последней целой записи", path)
+        with open(path, "r+b") as f:
+            f.truncate(end)
+
+
+class Journal(GameListener):
+    """Журнал с групповой фиксацией; один экземпляр слушает все столы"""
+
+    def __init__(self, directory: str, flush_interval: float = 0.005, batch_size: int = 64,
+                 segment_size: int = 4 * 1024 * 1024):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        # Продолжаем нумерацию и последний сегмент
+        segments = _segment_paths(directory)
+        if segments:
+            _truncate_torn_tail(segments[-1])
+        self.last_lsn = 0
+        for path in reversed(segments):
+            for record in _read_segment(path):
+                self.last_lsn = record["lsn"]
+            if self.last_lsn:
+                break
+        self._segment_index = int(os.path.basename(segments[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) if segments else 1
+        self._file = open(self._segment_path(self._segment_index), "ab")
+        # Первый LSN каждого сегмента - чтобы удалять целиком устаревшие
+        self._segment_first_lsn: Dict[int, int] = {}
+
+        self.durable_lsn = self.last_lsn
+        self._pending: List[bytes] = []
+        self._condition = threading.Condition()
+        self._waiters: List[Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}")
+
+    # ========== Запись ==========
+
+    def append(self, record: dict) -> int:
+        """Добавить запись; возвращает ее LSN (на диске она будет после следующего сброса)"""
+        with self._condition:
+            self.last_lsn += 1
+            record["lsn"] = self.last_lsn
+            self._pending.append(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+            return self.last_lsn
+
+    def wait(self, lsn: Optional[int] = None):
+        """Дождаться, пока запись lsn (по умолчанию - последняя) окажется на диске"""
+        with self._condition:
+            lsn = self.last_lsn if lsn is None else lsn
+            while self.durable_lsn < lsn:
+                self._condition.wait()
+
+    async def sync(self, lsn: Optional[int] = None):
+        """То же, что wait, но не блокирует event loop"""
+        with self._condition:
+            lsn = self.last_lsn if lsn is None else lsn
+            if self.durable_lsn >= lsn:
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiters.append((lsn, loop, future))
+        await future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+                # Ждем остаток окна, чтобы собрать пачку побольше
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                batch, self._pending = self._pending, []
+                batch_lsn = self.last_lsn
+
+            self._write(batch, batch_lsn - len(batch) + 1)
+
+            with self._condition:
+                self.durable_lsn = batch_lsn
+                self._condition.notify_all()
+                ready = [w for w in self._waiters if w[0] <= batch_lsn]
+                self._waiters = [w for w in self._waiters if w[0] > batch_lsn]
+            for _, loop, future in ready:
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def _write(self, batch: List[bytes], first_lsn: int):
+        if self._file.tell() >= self.segment_size:
+            self._file.close()
+            self._segment_index += 1
+            self._file = open(self._segment_path(self._segment_index), "ab")
+        self._segment_first_lsn.setdefault(self._segment_index, first_lsn)
+        self._file.write(b"".join(batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._file.close()
+
+    def discard_before(self, lsn: int):
+        """Удалить сегменты, все записи которых уже учтены в снимках (LSN <= lsn)"""
+        with self._condition:
+            current = self._segment_index
+        for path in _segment_paths(self.directory):
+            index = int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            if index >= current:
+                break
+            next_first = self._segment_first_lsn.get(index + 1)
+            if next_first is None:
+                # Сегмент из прошлого запуска - смотрим его последнюю запись
+                last = 0
+                for record in _read_segment(path):
+                    last = record["lsn"]
+                if last > lsn:
+                    break
+            elif next_first - 1 > lsn:
+                break
+            os.remove(path)
+            self._segment_first_lsn.pop(index, None)
+
+    # ========== События стола ==========
+
+    def log_join(self, game: PokerGame, user_id: int, name: str, buy_in: int) -> int:
+        return self.append({"type": "join", "game_id": game.game_id, "user_id": user_id,
+                            "name": name, "buy_in": buy_in})
+
+    def on_hand_start(self, game: PokerGame):
+        # Колода целиком: карманные карты по местам, затем оставшиеся
+        deck = [card.code for p in game.players for card in p.hand] + game.deck.codes()
+        self.append({"type": "start", "game_id": game.game_id,
+                     "dealer_position": game.dealer_position, "deck": deck})
+
+    def on_action(self, game: PokerGame, seat: int, action: str, amount: int):
+        self.append({"type": "action", "game_id": game.game_id, "seat": seat,
+                     "action": action, "amount": amount})
+
+    # ========== Восстановление ==========
+
+    def records_after(self, lsn: int) -> Iterator[dict]:
+        for path in _segment_paths(self.directory):
+            for record in _read_segment(path):
+                if record["lsn"] > lsn:
+                    yield record
+
+    def recover(self, games: Dict[str, Tuple[PokerGame, int]]) -> int:
+        """
+        Применить к столам записи после их снимков
+        games: game_id -> (стол из снимка, journal_lsn снимка); возвращает число примененных записей
+        """
+        if not games:
+            return 0
+        applied = 0
+        for record in self.records_after(min(lsn for _, lsn in games.values())):
+            entry = games.get(record["game_id"])
+            if entry is None or record["lsn"] <= entry[1]:
+                continue
+            apply_record(entry[0], record)
+            applied += 1
+        return applied
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def apply_record(game: PokerGame, record: dict):
+    """Повторить запись журнала на столе (слушатели стола не вызываются)"""
+    listeners, game.listeners = game.listeners, []
+    try:
+        kind = record["type"]
+        if kind == "join":
+            game.add_player(record["user_id"], record["name"], record["buy_in"])
+        elif kind == "start":
+            game.dealer_position = record["dealer_position"]
+            game.start_game()
+            deck = record["deck"]
+            for seat, player in enumerate(game.players):
+                player.hand = [_CARDS[code] for code in deck[seat * 2:seat * 2 + 2]]
+            game.deck = Deck.from_codes(deck[len(game.players) * 2:])
+        elif kind == "action":
+            user_id = game.players[record["seat"]].user_id
+            if not game.player_action(user_id, record["action"], record["amount"]):
+                logger.warning("Запись журнала %s не применилась к столу %s", record["lsn"], game.game_id)
+    finally:
+        game.listeners = listeners
@@ -1,7 +1,11 @@
 import random
+from bisect import bisect_left
 from enum import Enum
 from collections import Counter
-from typing import List, Tuple, Optional
+from itertools import combinations
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
 
 
 class Suit(Enum):
@@ -34,21 +38,62 @@ class Rank(Enum):
 
 
 class Card:
-    def __init__(self, rank: Rank, suit: Suit):
-        self.rank = rank
-        self.suit = suit
+    """
+    Карта - неизменяемый синглтон из фиксированной таблицы на 52 карты
+    code = (ранг - 2) * 4 + индекс масти, строка для вывода считается один раз
+    """
+    __slots__ = ("rank", "suit", "code", "_text")
+
+    def __new__(cls, rank: Rank, suit: Suit):
+        return _CARDS[(rank.value - 2) * 4 + _SUIT_INDEX[suit]]
+
+    @staticmethod
+    def from_code(code: int) -> "Card":
+        return _CARDS[code]
 
     def __str__(self):
-        return f"{self.rank.symbol}{self.suit.value}"
+        return self._text
 
     def __repr__(self):
-        return str(self)
+        return self._text
 
     def __lt__(self, other):
-        return self.rank.value < other.rank.value
+        return self.code >> 2 < other.code >> 2
 
     def __eq__(self, other):
-        return self.rank == other.rank and self.suit == other.suit
+        return self is other
+
+    def __hash__(self):
+        return self.code
+
+    def __reduce__(self):
+        return Card.from_code, (self.code,)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+_SUIT_INDEX = {suit: i for i, suit in enumerate(Suit)}
+
+
+def _build_card_table() -> Tuple[Card, ...]:
+    """Создает все 52 карты один раз при импорте"""
+    cards = []
+    for rank in Rank:
+        for suit in Suit:
+            card = object.__new__(Card)
+            card.rank = rank
+            card.suit = suit
+            card.code = len(cards)
+            card._text = f"{rank.symbol}{suit.value}"
+            cards.append(card)
+    return tuple(cards)
+
+
+_CARDS = _build_card_table()
 
 
 class HandRank(Enum):
@@ -70,20 +115,196 @@ class HandRank(Enum):
         return obj
 
 
+# ========== Таблицы быстрого оценщика ==========
+#
+# Сила руки кодируется одним целым числом: ранг комбинации в старших битах,
+# затем до пяти значений для сравнения по 4 бита. Порядок чисел совпадает
+# с порядком (HandRank, values), поэтому руки сравниваются обычным `>`.
+
+_RANK_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_WHEEL_MASK = 0b1000000001111  # A-2-3-4-5
+
+# Сколько значений для сравнения у каждой комбинации
+_VALUES_COUNT = {
+    HandRank.HIGH_CARD: 5,
+    HandRank.PAIR: 4,
+    HandRank.TWO_PAIR: 3,
+    HandRank.THREE_OF_A_KIND: 3,
+    HandRank.STRAIGHT: 1,
+    HandRank.FLUSH: 5,
+    HandRank.FULL_HOUSE: 2,
+    HandRank.FOUR_OF_A_KIND: 2,
+    HandRank.STRAIGHT_FLUSH: 1,
+    HandRank.ROYAL_FLUSH: 1,
+}
+
+
+def _pack_strength(hand_rank: HandRank, values: List[int]) -> int:
+    """Упаковка (ранг, значения) в одно сравнимое число"""
+    strength = hand_rank.value
+    for i in range(5):
+        strength = (strength << 4) | (values[i] if i < len(values) else 0)
+    return strength
+
+
+def _build_straight_table() -> List[int]:
+    """Старшая карта лучшего стрита для каждой 13-битной маски рангов (0 - нет стрита)"""
+    table = [0] * 8192
+    for mask in range(8192):
+        for high in range(12, 3, -1):
+            straight = 0b11111 << (high - 4)
+            if mask & straight == straight:
+                table[mask] = high + 2
+                break
+        else:
+            if mask & _WHEEL_MASK == _WHEEL_MASK:
+                table[mask] = 5
+    return table
+
+
+_STRAIGHT_HIGH = _build_straight_table()
+
+
+def _build_flush_table() -> List[int]:
+    """Сила лучшего флеша/стрит-флеша для каждой маски из 5+ карт одной масти"""
+    table = [0] * 8192
+    for mask in range(8192):
+        if bin(mask).count("1") < 5:
+            continue
+        high = _STRAIGHT_HIGH[mask]
+        if high == 14:
+            table[mask] = _pack_strength(HandRank.ROYAL_FLUSH, [14])
+        elif high:
+            table[mask] = _pack_strength(HandRank.STRAIGHT_FLUSH, [high])
+        else:
+            values = [r + 2 for r in range(12, -1, -1) if mask >> r & 1][:5]
+            table[mask] = _pack_strength(HandRank.FLUSH, values)
+    return table
+
+
+def _multiset_strength(counts: List[int]) -> int:
+    """Сила лучшей руки без учета мастей по количеству карт каждого ранга"""
+    present = [r for r in range(12, -1, -1) if counts[r]]
+    quads = [r for r in present if counts[r] == 4]
+    trips = [r for r in present if counts[r] == 3]
+    pairs = [r for r in present if counts[r] == 2]
+
+    if quads:
+        kicker = next(r for r in present if r != quads[0])
+        return _pack_strength(HandRank.FOUR_OF_A_KIND, [quads[0] + 2, kicker + 2])
+
+    if trips and (len(trips) > 1 or pairs):
+        pair = max(trips[1:] + pairs)
+        return _pack_strength(HandRank.FULL_HOUSE, [trips[0] + 2, pair + 2])
+
+    high = _STRAIGHT_HIGH[sum(1 << r for r in present)]
+    if high:
+        return _pack_strength(HandRank.STRAIGHT, [high])
+
+    if trips:
+        kickers = [r + 2 for r in present if r != trips[0]][:2]
+        return _pack_strength(HandRank.THREE_OF_A_KIND, [trips[0] + 2] + kickers)
+
+    if len(pairs) >= 2:
+        kicker = next(r for r in present if r not in pairs[:2])
+        return _pack_strength(HandRank.TWO_PAIR, [pairs[0] + 2, pairs[1] + 2, kicker + 2])
+
+    if pairs:
+        kickers = [r + 2 for r in present if r != pairs[0]][:3]
+        return _pack_strength(HandRank.PAIR, [pairs[0] + 2] + kickers)
+
+    return _pack_strength(HandRank.HIGH_CARD, [r + 2 for r in present[:5]])
+
+
+def _build_rank_table() -> Dict[int, int]:
+    """Произведение простых чисел рангов -> сила руки для всех наборов из 5-7 карт"""
+    table = {}
+    counts = [0] * 13
+
+    def fill(rank: int, cards_left: int, product: int):
+        if rank == 13:
+            if 7 - cards_left >= 5:
+                table[product] = _multiset_strength(counts)
+            return
+        prime = _RANK_PRIMES[rank]
+        for count in range(min(4, cards_left) + 1):
+            counts[rank] = count
+            fill(rank + 1, cards_left - count, product * prime ** count)
+        counts[rank] = 0
+
+    fill(0, 7, 1)
+    return table
+
+
+_FLUSH_TABLE = _build_flush_table()
+_RANK_TABLE = _build_rank_table()
+_CARD_PRIMES = tuple(_RANK_PRIMES[code >> 2] for code in range(52))
+_CARD_BITS = tuple(1 << (code >> 2) for code in range(52))
+
+# Те же таблицы в виде массивов NumPy для пакетной оценки:
+# отсортированные произведения рангов ищутся через searchsorted
+_NP_RANK_KEYS = np.array(sorted(_RANK_TABLE), dtype=np.int64)
+_NP_RANK_STRENGTHS = np.array([_RANK_TABLE[key] for key in _NP_RANK_KEYS.tolist()], dtype=np.int64)
+_NP_FLUSH_TABLE = np.array(_FLUSH_TABLE, dtype=np.int64)
+_NP_CARD_PRIMES = np.array(_CARD_PRIMES, dtype=np.int64)
+_NP_CARD_BITS = np.array(_CARD_BITS, dtype=np.int64)
+
+
 class Deck:
+    """Колода на bytearray кодов карт с курсором раздачи"""
+    __slots__ = ("_codes", "_position")
+
     def __init__(self):
-        self.cards = [Card(rank, suit) for rank in Rank for suit in Suit]
+        self._codes = bytearray(range(52))
+        self._position = 0
+        self.shuffle()
+
+    @property
+    def cards(self) -> List[Card]:
+        """Оставшиеся в колоде карты"""
+        return [_CARDS[code] for code in self._codes[self._position:]]
+
+    def __len__(self):
+        return 52 - self._position
+
+    @staticmethod
+    def from_codes(codes: List[int]) -> "Deck":
+        """Колода из заданных оставшихся карт (без перемешивания)"""
+        deck = Deck.__new__(Deck)
+        deck._codes = bytearray(codes)
+        deck._position = 0
+        return deck
+
+    def codes(self) -> List[int]:
+        """Коды оставшихся карт в порядке раздачи"""
+        return list(self._codes[self._position:])
+
+    def clone(self) -> "Deck":
+        deck = Deck.__new__(Deck)
+        deck._codes = bytearray(self._codes)
+        deck._position = self._position
+        return deck
+
+    def reset(self):
+        """Собирает все карты обратно и перемешивает"""
+        self._codes[:] = range(52)
+        self._position = 0
         self.shuffle()
 
     def shuffle(self):
-        random.shuffle(self.cards)
+        if self._position == 0:
+            random.shuffle(self._codes)
+        else:
+            remaining = self._codes[self._position:]
+            random.shuffle(remaining)
+            self._codes[self._position:] = remaining
 
     def deal(self, count: int = 1) -> List[Card]:
-        if count > len(self.cards):
+        start = self._position
+        if count > 52 - start:
             raise ValueError("Not enough cards in deck")
-        dealt_cards = self.cards[:count]
-        self.cards = self.cards[count:]
-        return dealt_cards
+        self._position = start + count
+        return [_CARDS[code] for code in self._codes[start:self._position]]
 
 
 class PokerHandEvaluator:
@@ -91,30 +312,142 @@ class PokerHandEvaluator:
     def evaluate(cards: List[Card]) -> Tuple[HandRank, List[int]]:
         """
         Оценивает покерную комбинацию
-        Возвращает (ранг комбинации, список значений для сравнения)
+        Возвращает (ранг комбинации, список значений для сравнения, лучшие 5 карт)
         """
         if len(cards) < 5:
             raise ValueError("Need at least 5 cards to evaluate")
 
-        sorted_cards = sorted(cards, key=lambda c: c.rank.value, reverse=True)
+        if len(cards) > 7:
+            return PokerHandEvaluator._evaluate_combinations(cards)
+
+        strength = PokerHandEvaluator.evaluate_strength(cards)
+        rank, values = PokerHandEvaluator.strength_to_hand(strength)
+
+        if len(cards) == 5:
+            best_hand = sorted(cards, key=lambda c: c.rank.value, reverse=True)
+        else:
+            best_hand = PokerHandEvaluator._select_best_cards(cards, rank, values)
+
+        return rank, values, best_hand
+
+    @staticmethod
+    def evaluate_strength(cards: List[Card]) -> int:
+        """Сила лучшей руки из 5-7 карт одним числом (больше - сильнее)"""
+        return PokerHandEvaluator.evaluate_codes([card.code for card in cards])
+
+    @staticmethod
+    def evaluate_codes(codes) -> int:
+        """
+        Сила руки по кодам карт (Card.code)
+        Две табличные выборки: по произведению простых рангов и по маскам мастей для флешей
+        """
+        product = 1
+        suit_masks = [0, 0, 0, 0]
+        for code in codes:
+            product *= _CARD_PRIMES[code]
+            suit_masks[code & 3] |= _CARD_BITS[code]
+
+        strength = _RANK_TABLE[product]
+        for mask in suit_masks:
+            # Для масок меньше чем из 5 карт в таблице 0
+            flush_strength = _FLUSH_TABLE[mask]
+            if flush_strength > strength:
+                strength = flush_strength
+        return strength
+
+    @staticmethod
+    def evaluate_many(codes) -> np.ndarray:
+        """
+        Пакетная оценка: массив (N, 5..7) кодов карт -> N сил рук (int64)
+        Результат совпадает с evaluate_codes для каждой строки
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        if codes.ndim != 2 or not 5 <= codes.shape[1] <= 7:
+            raise ValueError("Expected an (N, 5..7) array of card codes")
+
+        products = _NP_CARD_PRIMES[codes].prod(axis=1)
+        strengths = _NP_RANK_STRENGTHS[np.searchsorted(_NP_RANK_KEYS, products)]
+
+        bits = _NP_CARD_BITS[codes]
+        suits = codes & 3
+        for suit in range(4):
+            # Карты одной масти имеют разные ранги, поэтому сумма битов равна маске
+            masks = np.where(suits == suit, bits, 0).sum(axis=1)
+            np.maximum(strengths, _NP_FLUSH_TABLE[masks], out=strengths)
+        return strengths
+
+    @staticmethod
+    def winners_many(hole_cards, boards) -> np.ndarray:
+        """
+        Победители для множества бордов сразу
+        hole_cards: (P, 2) или (N, P, 2) коды карт игроков, boards: (N, 3..5)
+        Возвращает булеву маску (N, P): True у всех игроков с лучшей рукой (дележ - несколько True)
+        """
+        boards = np.asarray(boards, dtype=np.intp)
+        hole_cards = np.asarray(hole_cards, dtype=np.intp)
+        count = boards.shape[0]
+        if hole_cards.ndim == 2:
+            hole_cards = np.broadcast_to(hole_cards, (count,) + hole_cards.shape)
+        players = hole_cards.shape[1]
+
+        hands = np.concatenate(
+            [hole_cards, np.broadcast_to(boards[:, None, :], (count, players, boards.shape[1]))],
+            axis=2,
+        )
+        strengths = PokerHandEvaluator.evaluate_many(hands.reshape(count * players, -1))
+        strengths = strengths.reshape(count, players)
+        return strengths == strengths.max(axis=1, keepdims=True)
 
-        # Проверяем все возможные комбинации из 5 карт
+    @staticmethod
+    def strength_to_hand(strength: int) -> Tuple[HandRank, List[int]]:
+        """Обратное преобразование силы руки в (ранг комбинации, значения)"""
+        rank = HandRank(strength >> 20)
+        values = [(strength >> shift) & 0xF for shift in (16, 12, 8, 4, 0)]
+        return rank, values[:_VALUES_COUNT[rank]]
+
+    @staticmethod
+    def _select_best_cards(cards: List[Card], rank: HandRank, values: List[int]) -> List[Card]:
+        """Восстанавливает лучшие 5 карт по уже известной комбинации"""
+        if rank in (HandRank.STRAIGHT, HandRank.STRAIGHT_FLUSH, HandRank.ROYAL_FLUSH):
+            high = values[0]
+            needed = {v if v > 1 else 14: 1 for v in range(high, high - 5, -1)}
+        else:
+            multiplicity = {
+                HandRank.FOUR_OF_A_KIND: (4, 1),
+                HandRank.FULL_HOUSE: (3, 2),
+                HandRank.THREE_OF_A_KIND: (3, 1, 1),
+                HandRank.TWO_PAIR: (2, 2, 1),
+                HandRank.PAIR: (2, 1, 1, 1),
+            }.get(rank, (1, 1, 1, 1, 1))
+            needed = dict(zip(values, multiplicity))
+
+        flush_suit = None
+        if rank in (HandRank.FLUSH, HandRank.STRAIGHT_FLUSH, HandRank.ROYAL_FLUSH):
+            flush_suit = Counter(c.suit for c in cards).most_common(1)[0][0]
+
+        # Берем самые ранние подходящие карты - как первая лучшая комбинация из combinations()
+        best_hand = []
+        for card in cards:
+            if flush_suit is not None and card.suit != flush_suit:
+                continue
+            if needed.get(card.rank.value, 0) > 0:
+                needed[card.rank.value] -= 1
+                best_hand.append(card)
+        return best_hand
+
+    @staticmethod
+    def _evaluate_combinations(cards: List[Card]) -> Tuple[HandRank, List[int]]:
+        """Перебор всех комбинаций из 5 карт (для наборов больше 7 карт)"""
         best_hand = None
         best_rank = HandRank.HIGH_CARD
         best_values = []
 
-        # Если карт больше 5, проверяем все комбинации
-        if len(cards) > 5:
-            from itertools import combinations
-            for combo in combinations(cards, 5):
-                rank, values = PokerHandEvaluator._evaluate_five_cards(list(combo))
-                if rank.value > best_rank.value or (rank.value == best_rank.value and values > best_values):
-                    best_rank = rank
-                    best_values = values
-                    best_hand = list(combo)
-        else:
-            best_rank, best_values = PokerHandEvaluator._evaluate_five_cards(sorted_cards)
-            best_hand = sorted_cards
+        for combo in combinations(cards, 5):
+            rank, values = PokerHandEvaluator._evaluate_five_cards(list(combo))
+            if rank.value > best_rank.value or (rank.value == best_rank.value and values > best_values):
+                best_rank = rank
+                best_values = values
+                best_hand = list(combo)
 
         return best_rank, best_values, best_hand
 
@@ -218,12 +551,15 @@ class PokerHandEvaluator:
 
 
 class Player:
+    __slots__ = ("user_id", "name", "chips", "hand", "current_bet", "total_bet", "folded", "all_in")
+
     def __init__(self, user_id: int, name: str, chips: int = 1000):
         self.user_id = user_id
         self.name = name
         self.chips = chips
         self.hand: List[Card] = []
         self.current_bet = 0
+        self.total_bet = 0  # Вклад в банк за всю раздачу
         self.folded = False
         self.all_in = False
 
@@ -239,6 +575,7 @@ class Player:
             self.chips -= amount
 
         self.current_bet += bet
+        self.total_bet += bet
         return bet
 
     def fold(self):
@@ -247,11 +584,92 @@ class Player:
     def reset_for_new_hand(self):
         self.hand = []
         self.current_bet = 0
+        self.total_bet = 0
         self.folded = False
         self.all_in = False
 
+    def clone(self) -> "Player":
+        other = Player.__new__(Player)
+        other.user_id = self.user_id
+        other.name = self.name
+        other.chips = self.chips
+        other.hand = list(self.hand)
+        other.current_bet = self.current_bet
+        other.total_bet = self.total_bet
+        other.folded = self.folded
+        other.all_in = self.all_in
+        return other
+
+    def snapshot(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "name": self.name,
+            "chips": self.chips,
+            "hand": [card.code for card in self.hand],
+            "current_bet": self.current_bet,
+            "total_bet": self.total_bet,
+            "folded": self.folded,
+            "all_in": self.all_in,
+        }
+
+    @staticmethod
+    def from_snapshot(data: dict) -> "Player":
+        player = Player(data["user_id"], data["name"], data["chips"])
+        player.hand = [_CARDS[code] for code in data["hand"]]
+        player.current_bet = data["current_bet"]
+        player.total_bet = data["total_bet"]
+        player.folded = data["folded"]
+        player.all_in = data["all_in"]
+        return player
+
+
+class GameListener:
+    """
+    Наблюдатель за раздачей (история рук, статистика)
+    Вызывается синхронно из PokerGame, методы по умолчанию ничего не делают
+    """
+
+    def on_hand_start(self, game: "PokerGame"):
+        pass
+
+    def on_action(self, game: "PokerGame", seat: int, action: str, amount: int):
+        """amount - запрошенная сумма для raise, для остальных действий - фишки, добавленные в банк"""
+        pass
+
+    def on_showdown(self, game: "PokerGame", result: "ShowdownResult"):
+        pass
+
+
+class ShowdownResult:
+    """
+    Итог раздачи - считается один раз и хранится в PokerGame.showdown_result
+    hands: user_id -> (комбинация, значения, лучшие 5 карт), пусто если все сфолдили
+    payouts: user_id -> все зачисленные фишки (включая возврат неуравненной ставки)
+    pots: [{"amount", "eligible": [user_id], "winners": [user_id]}] - основной банк, затем побочные
+    """
+    __slots__ = ("winners", "hands", "payouts", "pots")
+
+    def __init__(self, winners: List[Player], hands: Dict[int, Tuple[HandRank, List[int], List[Card]]],
+                 payouts: Dict[int, int], pots: List[dict]):
+        self.winners = winners
+        self.hands = hands
+        self.payouts = payouts
+        self.pots = pots
+
 
 class PokerGame:
+    """
+    Состояние стола. Счетчики активных игроков и кольцевой список мест,
+    которые еще могут действовать, обновляются при каждом действии - переход хода за O(1)
+    """
+    __slots__ = (
+        "game_id", "small_blind", "big_blind", "players", "deck", "community_cards",
+        "pot", "current_bet", "dealer_position", "current_player_index", "stage",
+        "min_players", "max_players", "all_in_equity", "showdown_result", "listeners",
+        "_active_count", "_matched_count", "_contender_count", "_next_seat", "_prev_seat",
+        "_pot_levels",
+    )
+
     def __init__(self, game_id: str, small_blind: int = 10, big_blind: int = 20):
         self.game_id = game_id
         self.small_blind = small_blind
@@ -266,6 +684,21 @@ class PokerGame:
         self.stage = "waiting"  # waiting, preflop, flop, turn, river, showdown
         self.min_players = 2
         self.max_players = 9
+        self.all_in_equity: Optional[Dict[int, dict]] = None  # user_id -> эквити на момент олл-ина
+        self.showdown_result: Optional[ShowdownResult] = None
+        self.listeners: List[GameListener] = []
+
+        # Может действовать = не сфолдил и не в олл-ине
+        self._active_count = 0
+        # Активные игроки, уравнявшие текущую ставку
+        self._matched_count = 0
+        # Не сфолдившие игроки
+        self._contender_count = 0
+        # Кольцевой список активных мест; у выбывшего места остается ссылка на следующее
+        self._next_seat: List[int] = []
+        self._prev_seat: List[int] = []
+        # Отсортированные вклады игроков в олл-ине - границы побочных банков
+        self._pot_levels: List[int] = []
 
     def add_player(self, user_id: int, name: str, chips: int = 1000) -> bool:
         if len(self.players) >= self.max_players:
@@ -281,6 +714,9 @@ class PokerGame:
 
     def remove_player(self, user_id: int) -> bool:
         self.players = [p for p in self.players if p.user_id != user_id]
+        if self.players:
+            self.current_player_index %= len(self.players)
+        self._rebuild_turn_state()
         return True
 
     def start_game(self) -> bool:
@@ -288,21 +724,27 @@ class PokerGame:
             return False
 
         self.stage = "preflop"
-        self.deck = Deck()
+        self.deck.reset()
         self.community_cards = []
         self.pot = 0
         self.current_bet = 0
+        self.all_in_equity = None
+        self.showdown_result = None
 
         # Раздаем карты
         for player in self.players:
             player.reset_for_new_hand()
             player.hand = self.deck.deal(2)
+        self._rebuild_turn_state()
 
         # Ставим блайнды
         self._post_blinds()
 
         # Определяем первого игрока (после big blind)
-        self.current_player_index = (self.dealer_position + 3) % len(self.players)
+        self.current_player_index = self._first_active_from(self.dealer_position + 3)
+
+        for listener in self.listeners:
+            listener.on_hand_start(self)
 
         return True
 
@@ -311,24 +753,97 @@ class PokerGame:
         sb_index = (self.dealer_position + 1) % len(self.players)
         bb_index = (self.dealer_position + 2) % len(self.players)
 
-        sb_player = self.players[sb_index]
-        bb_player = self.players[bb_index]
-
         # Small blind
-        sb_bet = sb_player.bet(self.small_blind)
-        self.pot += sb_bet
+        self._apply_bet(sb_index, self.small_blind)
 
         # Big blind
-        bb_bet = bb_player.bet(self.big_blind)
-        self.pot += bb_bet
-        self.current_bet = self.big_blind
+        self._apply_bet(bb_index, self.big_blind)
+        if self.current_bet != self.big_blind:
+            # Big blind ушел в олл-ин меньше блайнда - ставка стола все равно равна блайнду
+            self.current_bet = self.big_blind
+            self._recount_matched()
+
+    # ========== Учет очереди хода ==========
+
+    def _rebuild_turn_state(self):
+        """Полный пересчет счетчиков и списка мест (новая раздача, изменение состава)"""
+        count = len(self.players)
+        active = [i for i, p in enumerate(self.players) if not p.folded and not p.all_in]
+
+        self._active_count = len(active)
+        self._contender_count = sum(1 for p in self.players if not p.folded)
+        self._next_seat = [(i + 1) % count for i in range(count)]
+        self._prev_seat = [(i - 1) % count for i in range(count)]
+        for k, seat in enumerate(active):
+            self._next_seat[seat] = active[(k + 1) % len(active)]
+            self._prev_seat[seat] = active[k - 1]
+        self._recount_matched()
+        self._pot_levels = sorted({p.total_bet for p in self.players if p.all_in and not p.folded})
+
+    def _recount_matched(self):
+        self._matched_count = sum(
+            1 for p in self.players
+            if not p.folded and not p.all_in and p.current_bet == self.current_bet
+        )
+
+    def _deactivate(self, seat: int):
+        """Игрок больше не может действовать в этой раздаче - убираем место из кольца"""
+        next_seat = self._next_seat[seat]
+        prev_seat = self._prev_seat[seat]
+        self._next_seat[prev_seat] = next_seat
+        self._prev_seat[next_seat] = prev_seat
+        self._active_count -= 1
+
+    def _first_active_from(self, seat: int) -> int:
+        """Первое место, начиная с seat, где игрок еще может действовать"""
+        seat %= len(self.players)
+        if not self._active_count:
+            return seat
+        player = self.players[seat]
+        while player.folded or player.all_in:
+            seat = self._next_seat[seat]
+            player = self.players[seat]
+        return seat
+
+    def _apply_bet(self, seat: int, amount: int) -> int:
+        """Ставка игрока на месте seat с обновлением банка и счетчиков"""
+        player = self.players[seat]
+        was_matched = player.current_bet == self.current_bet
+
+        bet = player.bet(amount)
+        self.pot += bet
+
+        if player.all_in:
+            self._deactivate(seat)
+            if was_matched:
+                self._matched_count -= 1
+            # Новая граница побочного банка
+            level = player.total_bet
+            position = bisect_left(self._pot_levels, level)
+            if position == len(self._pot_levels) or self._pot_levels[position] != level:
+                self._pot_levels.insert(position, level)
+        elif not was_matched and player.current_bet == self.current_bet:
+            self._matched_count += 1
+
+        if player.current_bet > self.current_bet:
+            # Ставку повысили - остальным снова нужно уравнивать
+            self.current_bet = player.current_bet
+            self._matched_count = 0 if player.all_in else 1
+        return bet
+
+    def _apply_fold(self, seat: int):
+        player = self.players[seat]
+        if player.current_bet == self.current_bet:
+            self._matched_count -= 1
+        player.fold()
+        self._contender_count -= 1
+        self._deactivate(seat)
 
     def get_current_player(self) -> Optional[Player]:
         if self.stage in ["waiting", "showdown"]:
             return None
 
-        active_players = [p for p in self.players if not p.folded and not p.all_in]
-        if not active_players:
+        if not self._active_count:
             return None
 
         return self.players[self.current_player_index]
@@ -342,27 +857,24 @@ class PokerGame:
         if not current_player or current_player.user_id != user_id:
             return False
 
+        seat = self.current_player_index
+        committed = current_player.total_bet
         if action == "fold":
-            current_player.fold()
+            self._apply_fold(seat)
         elif action == "check":
             if current_player.current_bet < self.current_bet:
                 return False  # Нельзя check если есть ставка
         elif action == "call":
-            call_amount = self.current_bet - current_player.current_bet
-            bet = current_player.bet(call_amount)
-            self.pot += bet
+            self._apply_bet(seat, self.current_bet - current_player.current_bet)
         elif action == "raise":
             if amount < self.current_bet * 2:
                 return False  # Минимальный рейз - удвоение текущей ставки
-            total_bet = amount - current_player.current_bet
-            bet = current_player.bet(total_bet)
-            self.pot += bet
-            self.current_bet = current_player.current_bet
+            self._apply_bet(seat, amount - current_player.current_bet)
         elif action == "all_in":
-            bet = current_player.bet(current_player.chips)
-            self.pot += bet
-            if current_player.current_bet > self.current_bet:
-                self.current_bet = current_player.current_bet
+            self._apply_bet(seat, current_player.chips)
+
+        for listener in self.listeners:
+            listener.on_action(self, seat, action, amount if action == "raise" else current_player.total_bet - committed)
 
         # Переход к следующему игроку
         self._next_player()
@@ -371,10 +883,11 @@ class PokerGame:
 
     def _next_player(self):
         """Переход к следующему игроку"""
-        active_players = [p for p in self.players if not p.folded and not p.all_in]
-
-        if len(active_players) <= 1:
-            # Все сфолдили или в all-in, переходим к showdown
+        # Торговаться больше не с кем: все сфолдили, все в олл-ине
+        # или единственный оставшийся игрок уже уравнял ставку
+        if (self._contender_count <= 1 or not self._active_count
+                or (self._active_count == 1 and self._matched_count == 1)):
+            self._record_all_in_equity()
             self._go_to_showdown()
             return
 
@@ -383,29 +896,13 @@ class PokerGame:
             self._advance_stage()
             return
 
-        # Следующий активный игрок
-        start_index = self.current_player_index
-        while True:
-            self.current_player_index = (self.current_player_index + 1) % len(self.players)
-            player = self.players[self.current_player_index]
-
-            if not player.folded and not player.all_in:
-                break
-
-            # Избегаем бесконечного цикла
-            if self.current_player_index == start_index:
-                self._advance_stage()
-                break
+        # Следующий активный игрок (у только что выбывшего места ссылка тоже ведет на активное)
+        self.current_player_index = self._next_seat[self.current_player_index]
 
     def _is_betting_round_complete(self) -> bool:
         """Проверка, завершен ли раунд торговли"""
-        active_players = [p for p in self.players if not p.folded and not p.all_in]
-
-        if not active_players:
-            return True
-
         # Все активные игроки сделали одинаковую ставку
-        return all(p.current_bet == self.current_bet for p in active_players)
+        return self._matched_count == self._active_count
 
     def _advance_stage(self):
         """Переход к следующей стадии игры"""
@@ -413,6 +910,7 @@ class PokerGame:
         for player in self.players:
             player.current_bet = 0
         self.current_bet = 0
+        self._matched_count = self._active_count
 
         if self.stage == "preflop":
             # Флоп - 3 карты
@@ -431,11 +929,125 @@ class PokerGame:
             self._go_to_showdown()
             return
 
-        # Первый игрок после дилера
-        self.current_player_index = (self.dealer_position + 1) % len(self.players)
+        # Первый активный игрок после дилера
+        self.current_player_index = self._first_active_from(self.dealer_position + 1)
+
+    # ========== Копии состояния ==========
+
+    def clone(self) -> "PokerGame":
+        """Независимая копия стола для симуляций и перебора (карты - общие синглтоны)"""
+        other = PokerGame.__new__(PokerGame)
+        for name in PokerGame.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.players = [p.clone() for p in self.players]
+        other.deck = self.deck.clone()
+        other.community_cards = list(self.community_cards)
+        other._next_seat = list(self._next_seat)
+        other._prev_seat = list(self._prev_seat)
+        other._pot_levels = list(self._pot_levels)
+        # Копия для симуляций не пишет историю и статистику
+        other.listeners = []
+        return other
+
+    def snapshot(self) -> dict:
+        """Полное состояние стола в JSON-совместимом виде (карты - коды)"""
+        return {
+            "game_id": self.game_id,
+            "small_blind": self.small_blind,
+            "big_blind": self.big_blind,
+            "min_players": self.min_players,
+            "max_players": self.max_players,
+            "stage": self.stage,
+            "pot": self.pot,
+            "current_bet": self.current_bet,
+            "dealer_position": self.dealer_position,
+            "current_player_index": self.current_player_index,
+            "community_cards": [card.code for card in self.community_cards],
+            "deck": self.deck.codes(),
+            "players": [p.snapshot() for p in self.players],
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "PokerGame":
+        game = cls(data["game_id"], data["small_blind"], data["big_blind"])
+        game.min_players = data["min_players"]
+        game.max_players = data["max_players"]
+        game.stage = data["stage"]
+        game.pot = data["pot"]
+        game.current_bet = data["current_bet"]
+        game.dealer_position = data["dealer_position"]
+        game.current_player_index = data["current_player_index"]
+        game.community_cards = [_CARDS[code] for code in data["community_cards"]]
+        game.deck = Deck.from_codes(data["deck"])
+        game.players = [Player.from_snapshot(p) for p in data["players"]]
+        game._rebuild_turn_state()
+        return game
+
+    def _record_all_in_equity(self):
+        """
+        Эквити игроков, дошедших до олл-ина, пока борд еще не открыт до конца
+        После флопа - точный перебор, на префлопе heads-up - таблица preflop_table
+        """
+        contenders = [p for p in self.players if not p.folded]
+        if len(contenders) < 2 or len(self.community_cards) >= 5:
+            return
+
+        if not self.community_cards:
+            # Префлоп: перебор слишком дорогой, берем готовую таблицу для heads-up
+            from preflop_table import get_table
+            table = get_table()
+            if table is None or len(contenders) != 2:
+                return
+            first = table.equity(contenders[0].hand, contenders[1].hand)
+            self.all_in_equity = {
+                contenders[0].user_id: {"equity": first},
+                contenders[1].user_id: {"equity": 1.0 - first},
+            }
+            return
+
+        from equity import exact_equity
+        results = exact_equity([p.hand for p in contenders], self.community_cards)
+        self.all_in_equity = {p.user_id: result for p, result in zip(contenders, results)}
+
+    def _run_out_board(self):
+        """Докладывает недостающие общие карты (торговля закончилась до ривера)"""
+        missing = 5 - len(self.community_cards)
+        if missing > 0:
+            self.community_cards.extend(self.deck.deal(missing))
+
+    def get_pots(self) -> List[Tuple[int, List[Player]]]:
+        """
+        Основной и побочные банки по вкладам игроков: [(сумма, претенденты)]
+        Границы банков - вклады игроков в олл-ине, последний банк - до максимального вклада
+        """
+        contenders = [p for p in self.players if not p.folded]
+        top = max((p.total_bet for p in contenders), default=0)
+        levels = [level for level in self._pot_levels if level < top] + [top]
+
+        pots = []
+        previous = 0
+        for level in levels:
+            amount = sum(min(p.total_bet, level) - min(p.total_bet, previous) for p in self.players)
+            eligible = [p for p in contenders if p.total_bet >= level]
+            pots.append((amount, eligible))
+            previous = level
+
+        # Фишки сфолдивших сверх максимального вклада оставшихся игроков идут в последний банк
+        dead = sum(p.total_bet - previous for p in self.players if p.total_bet > previous)
+        if dead:
+            amount, eligible = pots[-1]
+            pots[-1] = (amount + dead, eligible)
+        return pots
+
+    def _go_to_showdown(self) -> ShowdownResult:
+        """
+        Определение победителя
+        Считается один раз за раздачу: повторный вызов возвращает сохраненный результат
+        и не начисляет банк второй раз
+        """
+        if self.showdown_result is not None:
+            return self.showdown_result
 
-    def _go_to_showdown(self):
-        """Определение победителя"""
         self.stage = "showdown"
 
         active_players = [p for p in self.players if not p.folded]
@@ -444,36 +1056,70 @@ class PokerGame:
             # Все сфолдили, победитель автоматически
             winner = active_players[0]
             winner.chips += self.pot
-            return [winner]
-
-        # Оцениваем руки
-        player_hands = []
-        for player in active_players:
-            all_cards = player.hand + self.community_cards
-            rank, values, best_hand = PokerHandEvaluator.evaluate(all_cards)
-            player_hands.append((player, rank, values, best_hand))
-
-        # Сортируем по силе руки
-        player_hands.sort(key=lambda x: (x[1].value, x[2]), reverse=True)
-
-        # Определяем победителей (может быть несколько при равных руках)
-        winners = [player_hands[0]]
-        for i in range(1, len(player_hands)):
-            comparison = PokerHandEvaluator.compare_hands(
-                (player_hands[0][1], player_hands[0][2]),
-                (player_hands[i][1], player_hands[i][2])
+            self.showdown_result = ShowdownResult(
+                winners=[winner],
+                hands={},
+                payouts={winner.user_id: self.pot},
+                pots=[{"amount": self.pot, "eligible": [winner.user_id], "winners": [winner.user_id]}],
             )
-            if comparison == 0:
-                winners.append(player_hands[i])
-            else:
-                break
+            self._notify_showdown()
+            return self.showdown_result
 
-        # Делим банк между победителями
-        pot_share = self.pot // len(winners)
-        for winner_data in winners:
-            winner_data[0].chips += pot_share
+        self._run_out_board()
 
-        return [w[0] for w in winners], [w[1] for w in winners], [w[3] for w in winners]
+        # Оцениваем каждую руку один раз
+        strengths = {}
+        hands = {}
+        for player in active_players:
+            all_cards = player.hand + self.community_cards
+            strength = PokerHandEvaluator.evaluate_strength(all_cards)
+            rank, values = PokerHandEvaluator.strength_to_hand(strength)
+            strengths[player.user_id] = strength
+            hands[player.user_id] = (rank, values, PokerHandEvaluator._select_best_cards(all_cards, rank, values))
+
+        # Один общий список по силе руки для всех банков
+        ranked = sorted(active_players, key=lambda p: strengths[p.user_id], reverse=True)
+
+        # Лишняя фишка при дележе - первым победителям по часовой стрелке от дилера
+        count = len(self.players)
+        seat_of = {p.user_id: i for i, p in enumerate(self.players)}
+
+        def seat_order(player: Player) -> int:
+            return (seat_of[player.user_id] - self.dealer_position - 1) % count
+
+        payouts: Dict[int, int] = {}
+        pots = []
+        winners: List[Player] = []
+        for amount, eligible in self.get_pots():
+            eligible_ids = {p.user_id for p in eligible}
+            contenders = [p for p in ranked if p.user_id in eligible_ids]
+            best = strengths[contenders[0].user_id]
+            pot_winners = sorted((p for p in contenders if strengths[p.user_id] == best), key=seat_order)
+
+            share, odd_chips = divmod(amount, len(pot_winners))
+            for i, winner in enumerate(pot_winners):
+                won = share + (1 if i < odd_chips else 0)
+                winner.chips += won
+                payouts[winner.user_id] = payouts.get(winner.user_id, 0) + won
+
+            # Банк без соперников - это возврат неуравненной ставки, а не победа
+            if len(eligible) > 1:
+                for winner in pot_winners:
+                    if winner not in winners:
+                        winners.append(winner)
+            pots.append({
+                "amount": amount,
+                "eligible": [p.user_id for p in eligible],
+                "winners": [p.user_id for p in pot_winners],
+            })
+
+        self.showdown_result = ShowdownResult(winners=winners, hands=hands, payouts=payouts, pots=pots)
+        self._notify_showdown()
+        return self.showdown_result
+
+    def _notify_showdown(self):
+        for listener in self.listeners:
+            listener.on_showdown(self, self.showdown_result)
 
     def get_game_state(self) -> dict:
         """Возвращает текущее состояние игры"""
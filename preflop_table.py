@@ -0,0 +1,176 @@
+"""
+Таблица префлоп-эквити 169x169 для канонических стартовых рук
+
+Генерация (долго, запускается один раз):
+    python preflop_table.py --trials 20000 --workers 4
+
+Файл - 16 байт заголовка и матрица float32, которая открывается через numpy.memmap
+без разбора: все процессы бота делят одни и те же страницы из page cache.
+"""
+import argparse
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from poker_engine import Card, PokerHandEvaluator
+
+HAND_CLASSES = 169
+RANK_SYMBOLS = "23456789TJQKA"
+
+MAGIC = b"PFEQ"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQ")  # магия, версия, размер матрицы, число розыгрышей на пару
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop_equity.bin")
+
+
+def hand_class(card1: Card, card2: Card) -> int:
+    """
+    Индекс канонической руки 0..168 в сетке 13x13:
+    пары на диагонали, одномастные - [старшая][младшая], разномастные - [младшая][старшая]
+    """
+    high, low = card1.code >> 2, card2.code >> 2
+    if high < low:
+        high, low = low, high
+    if high != low and (card1.code & 3) == (card2.code & 3):
+        return high * 13 + low
+    return low * 13 + high
+
+
+def class_name(index: int) -> str:
+    """Название класса руки: AA, AKs, AKo"""
+    row, col = divmod(index, 13)
+    if row == col:
+        return RANK_SYMBOLS[row] * 2
+    if row > col:
+        return f"{RANK_SYMBOLS[row]}{RANK_SYMBOLS[col]}s"
+    return f"{RANK_SYMBOLS[col]}{RANK_SYMBOLS[row]}o"
+
+
+def class_combos(index: int) -> List[tuple]:
+    """Все конкретные комбинации карт класса (6 для пары, 4 одномастных, 12 разномастных)"""
+    row, col = divmod(index, 13)
+    high, low = max(row, col), min(row, col)
+    combos = []
+    for suit1 in range(4):
+        for suit2 in range(4):
+            first, second = high * 4 + suit1, low * 4 + suit2
+            if row == col and suit1 >= suit2:
+                continue
+            if row > col and suit1 != suit2:
+                continue
+            if row < col and suit1 == suit2:
+                continue
+            combos.append((first, second))
+    return combos
+
+
+def _matchup_deals(class1: int, class2: int) -> np.ndarray:
+    """Все непересекающиеся пары конкретных рук (N, 4): первые 2 кода - игрок 1, следующие 2 - игрок 2"""
+    deals = [
+        combo1 + combo2
+        for combo1 in class_combos(class1)
+        for combo2 in class_combos(class2)
+        if not set(combo1) & set(combo2)
+    ]
+    return np.array(deals, dtype=np.intp)
+
+
+def _row_equities(class1: int, trials: int, seed_sequence) -> np.ndarray:
+    """Воркер: эквити класса class1 против всех классов с большим индексом"""
+    rng = np.random.default_rng(seed_sequence)
+    row = np.zeros(HAND_CLASSES, dtype=np.float32)
+    row[class1] = 0.5  # Одинаковые классы симметричны
+
+    for class2 in range(class1 + 1, HAND_CLASSES):
+        deals = _matchup_deals(class1, class2)
+        picked = deals[rng.integers(0, len(deals), size=trials)]
+
+        # Карты игроков не должны попасть на борд
+        noise = rng.random((trials, 52))
+        np.put_along_axis(noise, picked, 2.0, axis=1)
+        boards = np.argpartition(noise, 5, axis=1)[:, :5]
+
+        holes = picked.reshape(trials, 2, 2)
+        winners = PokerHandEvaluator.winners_many(holes, boards)
+        shares = winners[:, 0] / winners.sum(axis=1)
+        row[class2] = shares.mean()
+    return row
+
+
+def generate(path: str = DEFAULT_PATH, trials: int = 20000, workers: Optional[int] = None,
+             seed: Optional[int] = None) -> np.ndarray:
+    """Считает таблицу эквити heads-up для всех пар классов и записывает ее в файл"""
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).spawn(HAND_CLASSES)
+    matrix = np.zeros((HAND_CLASSES, HAND_CLASSES), dtype=np.float32)
+
+    if workers == 1:
+        rows = [_row_equities(i, trials, seeds[i]) for i in range(HAND_CLASSES)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(_row_equities, range(HAND_CLASSES), [trials] * HAND_CLASSES, seeds))
+
+    for i, row in enumerate(rows):
+        matrix[i, i:] = row[i:]
+    # Эквити второго игрока - дополнение до 1
+    lower = np.tril_indices(HAND_CLASSES, -1)
+    matrix[lower] = 1.0 - matrix.T[lower]
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, HAND_CLASSES, trials))
+        f.write(matrix.astype("<f4").tobytes())
+    return matrix
+
+
+class PreflopEquityTable:
+    """Таблица префлоп-эквити, отображенная в память"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        with open(path, "rb") as f:
+            magic, version, size, trials = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != HAND_CLASSES:
+            raise ValueError(f"Invalid preflop equity table: {path}")
+
+        self.path = path
+        self.trials = trials
+        self.matrix = np.memmap(path, dtype="<f4", mode="r", offset=HEADER.size,
+                                shape=(HAND_CLASSES, HAND_CLASSES))
+
+    def equity_by_class(self, class1: int, class2: int) -> float:
+        return float(self.matrix[class1, class2])
+
+    def equity(self, hand1: List[Card], hand2: List[Card]) -> float:
+        """Эквити руки hand1 против hand2 (в среднем по мастям их классов)"""
+        return float(self.matrix[hand_class(*hand1), hand_class(*hand2)])
+
+
+_table: Optional[PreflopEquityTable] = None
+
+
+def get_table() -> Optional[PreflopEquityTable]:
+    """Общая таблица по умолчанию; None, если файл еще не сгенерирован"""
+    global _table
+    if _table is None and os.path.exists(DEFAULT_PATH):
+        _table = PreflopEquityTable(DEFAULT_PATH)
+    return _table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация таблицы префлоп-эквити 169x169")
+    parser.add_argument("--output", default=DEFAULT_PATH)
+    parser.add_argument("--trials", type=int, default=20000, help="Розыгрышей на каждую пару классов")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    generate(args.output, args.trials, args.workers, args.seed)
+    print(f"Saved {args.output} in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
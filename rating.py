@@ -0,0 +1,118 @@
+"""
+Рейтинг Эло для раздач с несколькими игроками
+
+Раздача считается набором попарных матчей каждого с каждым: кто закончил раздачу
+с большим результатом (чистым выигрышем), тот выиграл матч, равный результат - ничья.
+Изменение рейтинга = K / (n - 1) * сумма (результат матча - ожидаемый результат).
+
+    python rating.py --recompute    # пересчитать все рейтинги по game_history
+"""
+import argparse
+import logging
+from itertools import groupby
+from typing import List
+
+from sqlalchemy import bindparam, update
+
+logger = logging.getLogger(__name__)
+
+INITIAL_RATING = 1000
+K_FACTOR = 32
+
+
+def expected_score(rating: float, opponent: float) -> float:
+    """Ожидаемый результат матча с соперником (0..1)"""
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def elo_deltas(ratings: List[int], results: List[int], k: float = K_FACTOR) -> List[int]:
+    """Изменения рейтинга участников одной раздачи; results - чем больше, тем лучше"""
+    count = len(ratings)
+    if count < 2:
+        return [0] * count
+
+    deltas = []
+    for i in range(count):
+        total = 0.0
+        for j in range(count):
+            if i == j:
+                continue
+            if results[i] > results[j]:
+                score = 1.0
+            elif results[i] == results[j]:
+                score = 0.5
+            else:
+                score = 0.0
+            total += score - expected_score(ratings[i], ratings[j])
+        deltas.append(round(k * total / (count - 1)))
+    return deltas
+
+
+def apply_hand(ratings: dict, user_ids: List[int], results: List[int], k: float = K_FACTOR):
+    """Обновить рейтинги в словаре user_id -> рейтинг по итогам раздачи (не ниже нуля)"""
+    current = [ratings.get(user_id, INITIAL_RATING) for user_id in user_ids]
+    for user_id, rating, delta in zip(user_ids, current, elo_deltas(current, results, k)):
+        ratings[user_id] = max(0, rating + delta)
+
+
+def recompute_ratings(db, k: float = K_FACTOR, chunk_size: int = 1000) -> int:
+    """
+    Пересчитать рейтинги всех сыгравших игроков по истории за один проход
+    История читается потоком пачками по chunk_size (yield_per), в памяти - только
+    словарь user_id -> рейтинг; запись - пакетными UPDATE по chunk_size строк,
+    каждая пачка в своей короткой транзакции. Игроки без истории не меняются.
+    Возвращает число обновленных игроков
+    """
+    # database импортирует этот модуль - здесь импорт только при вызове
+    from database import GameHistoryParticipant, PlayerProfile
+
+    ratings = {}
+    hands = 0
+    with db.session_scope() as session:
+        rows = session.query(
+            GameHistoryParticipant.history_id,
+            GameHistoryParticipant.user_id,
+            GameHistoryParticipant.profit,
+        ).order_by(GameHistoryParticipant.history_id, GameHistoryParticipant.id).yield_per(chunk_size)
+
+        for _, participants in groupby(rows, key=lambda row: row.history_id):
+            participants = list(participants)
+            apply_hand(ratings, [p.user_id for p in participants], [p.profit for p in participants], k)
+            hands += 1
+    logger.info("Пересчитано раздач: %s, игроков: %s", hands, len(ratings))
+
+    table = PlayerProfile.__table__
+    statement = update(table).where(table.c.user_id == bindparam("b_user_id")).values(rating=bindparam("b_rating"))
+    items = list(ratings.items())
+    for start in range(0, len(items), chunk_size):
+        with db.session_scope() as session:
+            session.execute(statement, [
+                {"b_user_id": user_id, "b_rating": rating}
+                for user_id, rating in items[start:start + chunk_size]
+            ])
+
+    # Кэш профилей и топ в памяти собраны по старым рейтингам
+    db.cache.clear()
+    db.ratings.loaded = False
+    return len(items)
+
+
+def main():
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Рейтинг Эло игроков")
+    parser.add_argument("--recompute", action="store_true", help="Пересчитать все рейтинги по истории раздач")
+    parser.add_argument("--k", type=float, default=K_FACTOR)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.recompute:
+        updated = recompute_ratings(Database(), args.k, args.chunk_size)
+        print(f"Обновлено рейтингов: {updated}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Воспроизведение раздач из истории hand_history без Telegram
+
+    python replay.py hand_history --verify          # переиграть все раздачи и сверить выплаты
+    python replay.py hand_history --seek 12345      # состояние стола после действия 12345
+
+Действия нумеруются сквозным индексом по всем раздачам: индекс i - состояние
+после i-го действия (0 - начало первой раздачи). Записи в память не загружаются:
+при открытии история читается один раз и запоминается место каждой раздачи
+в сегменте, нужная раздача читается с диска при переходе к ней.
+
+Начало раздачи восстанавливается из записи без проигрывания предыдущих раздач,
+поэтому точки сохранения нужны только внутри длинных раздач: копия стола
+сохраняется после каждых checkpoint_interval действий от начала раздачи.
+"""
+import argparse
+import json
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple
+
+from hand_history import HandRecord, iter_hands, iter_positions, read_hand
+from poker_engine import _CARDS, Deck, PokerGame
+
+
+def deal_hand(record: HandRecord) -> PokerGame:
+    """Стол в начале раздачи: стеки, блайнды и карты как в записи, колода уложена по борду"""
+    game = PokerGame(record.game_id, record.small_blind, record.big_blind)
+    for seat in record.seats:
+        game.add_player(seat["user_id"], seat["name"], seat["stack"])
+    game.dealer_position = record.dealer_position
+    game.start_game()
+
+    # Подменяем случайную раздачу: карманные карты из записи, дальше борд, потом остальные карты по порядку
+    used = set(record.board)
+    for player, seat in zip(game.players, record.seats):
+        player.hand = [_CARDS[code] for code in seat["hand"]]
+        used.update(seat["hand"])
+    game.deck = Deck.from_codes(list(record.board) + [code for code in range(52) if code not in used])
+    return game
+
+
+def apply_action(game: PokerGame, seat: int, action: str, amount: int):
+    if not game.player_action(game.players[seat].user_id, action, amount):
+        raise ValueError(f"Action {action} {amount} of seat {seat} rejected in game {game.game_id}")
+
+
+class Replay:
+    """Перемотка по истории раздач с точками сохранения внутри раздач"""
+
+    def __init__(self, path: str, checkpoint_interval: int = 32):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+
+        # Место каждой раздачи: (номер сегмента в segments, смещение кадра)
+        self.segments: List[str] = []
+        self._positions: List[Tuple[int, int]] = []
+        # offsets[h] - сквозной индекс начала раздачи h
+        self.offsets: List[int] = [0]
+        for segment, offset, record in iter_positions(path):
+            if not self.segments or self.segments[-1] != segment:
+                self.segments.append(segment)
+            self._positions.append((len(self.segments) - 1, offset))
+            self.offsets.append(self.offsets[-1] + len(record.actions))
+
+        # Точки сохранения: сквозной индекс (начало раздачи + номер действия) -> копия стола
+        self._checkpoints: Dict[int, PokerGame] = {}
+        self._checkpoint_keys: List[int] = []
+        self._last: Tuple[int, HandRecord] = (-1, None)
+
+    @property
+    def hand_count(self) -> int:
+        return len(self._positions)
+
+    @property
+    def total_actions(self) -> int:
+        return self.offsets[-1]
+
+    def record(self, hand: int) -> HandRecord:
+        """Запись раздачи с диска; последняя прочитанная запоминается"""
+        if self._last[0] != hand:
+            segment, offset = self._positions[hand]
+            self._last = (hand, read_hand(self.segments[segment], offset))
+        return self._last[1]
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """Сквозной индекс -> (номер раздачи, число примененных в ней действий)"""
+        if not 0 <= index <= self.total_actions or not self._positions:
+            raise IndexError(f"Action index {index} out of range 0..{self.total_actions}")
+        hand = max(bisect_left(self.offsets, index) - 1, 0)
+        return hand, index - self.offsets[hand]
+
+    def _save_checkpoint(self, index: int, game: PokerGame):
+        if index not in self._checkpoints:
+            self._checkpoints[index] = game.clone()
+            self._checkpoint_keys.insert(bisect_left(self._checkpoint_keys, index), index)
+
+    def seek(self, index: int) -> PokerGame:
+        """Стол после index действий; возвращается независимая копия"""
+        hand, applied = self.locate(index)
+        start = self.offsets[hand]
+        record = self.record(hand)
+
+        # Ближайшая точка сохранения внутри той же раздачи, иначе - начало раздачи
+        position = bisect_right(self._checkpoint_keys, index) - 1
+        if position >= 0 and self._checkpoint_keys[position] > start:
+            done = self._checkpoint_keys[position] - start
+            game = self._checkpoints[self._checkpoint_keys[position]].clone()
+        else:
+            done = 0
+            game = deal_hand(record)
+
+        for step in range(done, applied):
+            apply_action(game, *record.actions[step])
+            if (step + 1) % self.checkpoint_interval == 0:
+                self._save_checkpoint(start + step + 1, game)
+        return game
+
+    def verify(self) -> List[str]:
+        """Переигрывает все раздачи потоком и сверяет борд и выплаты с записью; возвращает расхождения"""
+        mismatches = []
+        for hand, record in enumerate(iter_hands(self.path)):
+            try:
+                game = deal_hand(record)
+                for action in record.actions:
+                    apply_action(game, *action)
+            except ValueError as e:
+                mismatches.append(f"hand {hand}: {e}")
+                continue
+
+            if game.stage != "showdown":
+                mismatches.append(f"hand {hand}: ended at stage {game.stage}")
+                continue
+            board = [card.code for card in game.community_cards]
+            if board != record.board:
+                mismatches.append(f"hand {hand}: board {board} != {record.board}")
+            payouts = {
+                seat: game.showdown_result.payouts[p.user_id]
+                for seat, p in enumerate(game.players) if p.user_id in game.showdown_result.payouts
+            }
+            if payouts != dict(record.payouts):
+                mismatches.append(f"hand {hand}: payouts {payouts} != {dict(record.payouts)}")
+        return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение истории раздач")
+    parser.add_argument("path", help="Файл сегмента или папка с историей")
+    parser.add_argument("--verify", action="store_true", help="Сверить все раздачи с текущим движком")
+    parser.add_argument("--seek", type=int, help="Показать стол после заданного действия")
+    parser.add_argument("--checkpoint-interval", type=int, default=32)
+    args = parser.parse_args()
+
+    replay = Replay(args.path, args.checkpoint_interval)
+    print(f"Раздач: {replay.hand_count}, действий: {replay.total_actions}")
+
+    if args.seek is not None:
+        print(json.dumps(replay.seek(args.seek).snapshot(), indent=2, ensure_ascii=False))
+
+    if args.verify:
+        mismatches = replay.verify()
+        for line in mismatches:
+            print(line)
+        print(f"Расхождений: {len(mismatches)}")
+        if mismatches:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Симулятор игр без Telegram: боты со скриптовыми стратегиями играют через PokerGame
+
+    python simulate.py --hands 100000 --players 6 --strategies random,station,tight,equity \
+        --output sim.json --baseline sim_baseline.json
+
+Печатает и сохраняет в JSON: раздачи/сек, действия/сек, вызовы оценщика на раздачу,
+память на стол. С --baseline показывает изменение относительно прошлого прогона.
+"""
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from poker_engine import PokerGame, PokerHandEvaluator, Player
+from preflop_table import get_table, hand_class
+
+
+class Strategy:
+    """Стратегия бота: по состоянию стола возвращает (действие, сумма)"""
+    name = "base"
+
+    def decide(self, game: PokerGame, player: Player, rng: random.Random) -> Tuple[str, int]:
+        raise NotImplementedError
+
+    @staticmethod
+    def raise_amount(game: PokerGame) -> int:
+        return max(game.current_bet * 2, game.big_blind)
+
+    @staticmethod
+    def check_or_fold(game: PokerGame, player: Player) -> Tuple[str, int]:
+        if player.current_bet >= game.current_bet:
+            return "check", 0
+        return "fold", 0
+
+
+class RandomStrategy(Strategy):
+    """Случайное действие"""
+    name = "random"
+
+    def decide(self, game, player, rng):
+        action = rng.choice(["fold", "check", "call", "call", "raise", "all_in"])
+        if action == "check" and player.current_bet < game.current_bet:
+            action = "call"
+        if action == "all_in" and rng.random() < 0.8:
+            action = "call"
+        return action, self.raise_amount(game)
+
+
+class CallingStationStrategy(Strategy):
+    """Всегда коллирует или чекает"""
+    name = "station"
+
+    def decide(self, game, player, rng):
+        if player.current_bet >= game.current_bet:
+            return "check", 0
+        return "call", 0
+
+
+class TightStrategy(Strategy):
+    """Играет только сильные стартовые руки, с топ-парой и лучше - ставит"""
+    name = "tight"
+
+    def decide(self, game, player, rng):
+        high, low = sorted((card.rank.value for card in player.hand), reverse=True)
+        pocket_pair = high == low
+
+        if game.stage == "preflop":
+            if (pocket_pair and high >= 10) or (high == 14 and low >= 12):
+                return "raise", self.raise_amount(game)
+            if pocket_pair or (high >= 11 and low >= 10):
+                return "call", 0
+            return self.check_or_fold(game, player)
+
+        rank, _, _ = PokerHandEvaluator.evaluate(player.hand + game.community_cards)
+        if rank.value >= 3:
+            return "raise", self.raise_amount(game)
+        if rank.value == 2:
+            return "call", 0
+        return self.check_or_fold(game, player)
+
+
+class EquityStrategy(Strategy):
+    """
+    Решает по эквити против случайных рук оставшихся соперников:
+    префлоп - таблица preflop_table, дальше - быстрая выборка через winners_many
+    """
+    name = "equity"
+    samples = 128
+
+    def __init__(self):
+        self.table = get_table()
+        self.np_rng = np.random.default_rng(0)
+
+    def equity(self, game: PokerGame, player: Player) -> float:
+        opponents = sum(1 for p in game.players if not p.folded) - 1
+        if game.stage == "preflop" and self.table is not None:
+            own = hand_class(*player.hand)
+            # Средняя эквити против любой руки, приближенно для нескольких соперников
+            return float(self.table.matrix[own].mean()) ** opponents
+
+        known = [card.code for card in player.hand + game.community_cards]
+        deck = np.array([code for code in range(52) if code not in set(known)], dtype=np.intp)
+        missing = 5 - len(game.community_cards)
+        needed = missing + 2 * opponents
+
+        picks = deck[np.argpartition(self.np_rng.random((self.samples, len(deck))), needed, axis=1)[:, :needed]]
+        board = np.concatenate([
+            np.broadcast_to(np.array([c.code for c in game.community_cards], dtype=np.intp),
+                            (self.samples, len(game.community_cards))),
+            picks[:, :missing],
+        ], axis=1)
+        own = np.broadcast_to(np.array([c.code for c in player.hand], dtype=np.intp), (self.samples, 1, 2))
+        holes = np.concatenate([own, picks[:, missing:].reshape(self.samples, opponents, 2)], axis=1)
+
+        winners = PokerHandEvaluator.winners_many(holes, board)
+        return float((winners[:, 0] / winners.sum(axis=1)).mean())
+
+    def decide(self, game, player, rng):
+        equity = self.equity(game, player)
+        to_call = game.current_bet - player.current_bet
+        pot_odds = to_call / (game.pot + to_call) if to_call else 0.0
+
+        if equity > 0.75:
+            return "raise", self.raise_amount(game)
+        if equity >= pot_odds:
+            return ("call", 0) if to_call else ("check", 0)
+        return self.check_or_fold(game, player)
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in (RandomStrategy, CallingStationStrategy, TightStrategy, EquityStrategy)
+}
+
+
+class _EvaluatorCounter:
+    """
+    Подсчет оценок рук на время симуляции: calls - вызовы evaluate_codes по одной руке,
+    batch_rows - руки, оцененные пачками через evaluate_many (winners_many, эквити)
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.batch_rows = 0
+        self._original = None
+        self._original_many = None
+
+    def __enter__(self):
+        self._original = PokerHandEvaluator.evaluate_codes
+        self._original_many = PokerHandEvaluator.evaluate_many
+
+        def counted(codes):
+            self.calls += 1
+            return self._original(codes)
+
+        def counted_many(codes):
+            strengths = self._original_many(codes)
+            self.batch_rows += len(strengths)
+            return strengths
+
+        PokerHandEvaluator.evaluate_codes = staticmethod(counted)
+        PokerHandEvaluator.evaluate_many = staticmethod(counted_many)
+        return self
+
+    def __exit__(self, *exc):
+        PokerHandEvaluator.evaluate_codes = staticmethod(self._original)
+        PokerHandEvaluator.evaluate_many = staticmethod(self._original_many)
+
+
+def measure_table_memory(players: int, stack: int, tables: int = 200) -> int:
+    """Память на один стол с розданной раздачей (байт)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = []
+    for t in range(tables):
+        game = PokerGame(f"mem{t}")
+        for seat in range(players):
+            game.add_player(seat + 1, f"Bot {seat + 1}", stack)
+        game.start_game()
+        games.append(game)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used // tables
+
+
+def simulate(hands: int = 10000, players: int = 6, strategies: Optional[List[str]] = None,
+             stack: int = 1000, small_blind: int = 10, big_blind: int = 20, seed: int = 0) -> Dict:
+    """Играет hands раздач за одним столом и возвращает метрики"""
+    strategies = strategies or ["random"]
+    random.seed(seed)
+    rng = random.Random(seed)
+    bots = [STRATEGIES[strategies[seat % len(strategies)]]() for seat in range(players)]
+
+    game = PokerGame("simulation", small_blind, big_blind)
+    for seat in range(players):
+        game.add_player(seat + 1, f"Bot {seat + 1}", stack)
+
+    actions = 0
+    rejected = 0
+    with _EvaluatorCounter() as counter:
+        started = time.perf_counter()
+        for hand in range(hands):
+            # Проигравшимся выдаем новый стек
+            for player in game.players:
+                if player.chips < big_blind:
+                    player.chips = stack
+            game.dealer_position = hand % players
+            game.start_game()
+
+            while game.stage != "showdown":
+                player = game.get_current_player()
+                seat = game.current_player_index
+                action, amount = bots[seat].decide(game, player, rng)
+                if not game.player_action(player.user_id, action, amount):
+                    rejected += 1
+                    game.player_action(player.user_id, "call")
+                actions += 1
+        elapsed = time.perf_counter() - started
+
+    return {
+        "hands": hands,
+        "players": players,
+        "strategies": strategies,
+        "seed": seed,
+        "seconds": round(elapsed, 3),
+        "hands_per_sec": round(hands / elapsed, 1),
+        "actions_per_sec": round(actions / elapsed, 1),
+        "actions_per_hand": round(actions / hands, 2),
+        "rejected_actions": rejected,
+        "evaluator_calls_per_hand": round(counter.calls / hands, 2),
+        "batch_evaluations_per_hand": round(counter.batch_rows / hands, 2),
+        "memory_per_table_bytes": measure_table_memory(players, stack),
+        "python": platform.python_version(),
+    }
+
+
+def compare(result: Dict, baseline: Dict) -> Dict[str, float]:
+    """Отношение метрик к базовому прогону (>1 - выросло)"""
+    keys = ["hands_per_sec", "actions_per_sec", "evaluator_calls_per_hand", "batch_evaluations_per_hand",
+            "memory_per_table_bytes"]
+    return {key: round(result[key] / baseline[key], 3) for key in keys if baseline.get(key)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Самоигра ботов и замер скорости PokerGame")
+    parser.add_argument("--hands", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=6)
+    parser.add_argument("--strategies", default="random,station,tight,equity",
+                        help=f"Через запятую по местам: {', '.join(STRATEGIES)}")
+    parser.add_argument("--stack", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Куда сохранить результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    result = simulate(args.hands, args.players, args.strategies.split(","), args.stack, seed=args.seed)
+    if args.baseline:
+        with open(args.baseline) as f:
+            result["vs_baseline"] = compare(result, json.load(f))
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
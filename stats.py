@@ -0,0 +1,150 @@
+"""
+Статистика стиля игры: VPIP, PFR, фактор агрессии, доля вскрытий
+
+Счетчики обновляются по событиям PokerGame за O(1) на действие и копятся в памяти;
+в player_style_stats они уходят пачкой прибавлений через max_delay секунд или
+при накоплении max_hands раздач. Карточка игрока берет сохраненные счетчики плюс
+еще не записанные, без разбора истории раздач.
+
+    VPIP - доля раздач с добровольным вложением префлоп (колл, рейз, олл-ин)
+    PFR  - доля раздач с рейзом префлоп
+    AF   - (рейзы + олл-ины) / коллы на всех улицах
+    WTSD - доля вскрытий среди раздач, где игрок увидел флоп
+"""
+import asyncio
+import logging
+from concurrent.futures import Future
+from typing import Dict, Optional, Set
+
+from database import STYLE_COUNTERS, AsyncDatabase
+from poker_engine import GameListener, PokerGame, ShowdownResult
+
+logger = logging.getLogger(__name__)
+
+AGGRESSIVE_ACTIONS = ("raise", "all_in")
+VOLUNTARY_ACTIONS = ("call", "raise", "all_in")
+
+
+class _HandFlags:
+    """Отметки одной текущей раздачи стола - чтобы VPIP и PFR считались раз за раздачу"""
+    __slots__ = ("vpip", "pfr", "folded_preflop")
+
+    def __init__(self):
+        self.vpip: Set[int] = set()
+        self.pfr: Set[int] = set()
+        self.folded_preflop: Set[int] = set()
+
+
+class StyleTracker(GameListener):
+    """Счетчики стиля игры; один экземпляр слушает все столы"""
+
+    def __init__(self, db: AsyncDatabase, max_hands: int = 32, max_delay: float = 5.0):
+        self.db = db
+        self.max_hands = max_hands
+        self.max_delay = max_delay
+        self._hands: Dict[str, _HandFlags] = {}  # game_id -> отметки текущей раздачи
+        self._pending: Dict[int, Dict[str, int]] = {}  # user_id -> еще не записанные прибавки
+        self._pending_hands = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _add(self, user_id: int, counter: str):
+        counters = self._pending.get(user_id)
+        if counters is None:
+            counters = self._pending[user_id] = dict.fromkeys(STYLE_COUNTERS, 0)
+        counters[counter] += 1
+
+    # ========== События стола ==========
+
+    def on_hand_start(self, game: PokerGame):
+        self._hands[game.game_id] = _HandFlags()
+        for player in game.players:
+            self._add(player.user_id, "hands")
+
+    def on_action(self, game: PokerGame, seat: int, action: str, amount: int):
+        flags = self._hands.get(game.game_id)
+        if flags is None:
+            return
+        user_id = game.players[seat].user_id
+
+        if action in AGGRESSIVE_ACTIONS:
+            self._add(user_id, "aggressive")
+        elif action == "call":
+            self._add(user_id, "calls")
+
+        if game.stage != "preflop":
+            return
+        if action == "fold":
+            flags.folded_preflop.add(user_id)
+        if action in VOLUNTARY_ACTIONS and user_id not in flags.vpip:
+            flags.vpip.add(user_id)
+            self._add(user_id, "vpip")
+        if action in AGGRESSIVE_ACTIONS and user_id not in flags.pfr:
+            flags.pfr.add(user_id)
+            self._add(user_id, "pfr")
+
+    def on_showdown(self, game: PokerGame, result: ShowdownResult):
+        flags = self._hands.pop(game.game_id, None)
+        if flags is None:
+            return
+        if len(game.community_cards) >= 3:
+            for player in game.players:
+                if player.user_id not in flags.folded_preflop:
+                    self._add(player.user_id, "saw_flop")
+        # hands пуст, если все сфолдили - до вскрытия дело не дошло
+        for user_id in result.hands:
+            self._add(user_id, "showdowns")
+
+        self._pending_hands += 1
+        self._schedule()
+
+    # ========== Запись ==========
+
+    def _schedule(self):
+        if self._pending_hands >= self.max_hands:
+            self.flush()
+        elif self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            self._timer = loop.call_later(self.max_delay, self.flush)
+
+    def flush(self) -> Optional[Future]:
+        """Поставить накопленные счетчики в очередь потока базы"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        self._pending_hands = 0
+        if not pending:
+            return None
+        future = self.db.submit("add_style_stats", pending)
+        future.add_done_callback(_log_flush_error)
+        return future
+
+    async def get(self, user_id: int) -> Dict[str, int]:
+        """Счетчики игрока: записанные в базе плюс еще не записанные"""
+        # Поток базы выполняет вызовы по очереди - отправленные до чтения flush уже учтены в ответе.
+        # Еще не записанное копируем до await: flush во время чтения встанет в очередь после него
+        pending = dict(self._pending.get(user_id) or {})
+        stored = await self.db.get_style_stats(user_id) or dict.fromkeys(STYLE_COUNTERS, 0)
+        if pending:
+            stored = {name: stored[name] + pending[name] for name in STYLE_COUNTERS}
+        return stored
+
+
+def _log_flush_error(future: Future):
+    if future.exception() is not None:
+        logger.error("Не удалось записать статистику стиля игры", exc_info=future.exception())
+
+
+def style_summary(counters: Dict[str, int]) -> Dict[str, Optional[float]]:
+    """VPIP, PFR и WTSD в процентах, AF - отношение; None, если считать не из чего"""
+    hands = counters["hands"]
+    return {
+        "vpip": counters["vpip"] / hands * 100 if hands else None,
+        "pfr": counters["pfr"] / hands * 100 if hands else None,
+        "af": counters["aggressive"] / counters["calls"] if counters["calls"] else None,
+        "wtsd": counters["showdowns"] / counters["saw_flop"] * 100 if counters["saw_flop"] else None,
+    }
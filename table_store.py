@@ -0,0 +1,281 @@
+"""
+Сохранение активных столов в GameTable.game_state
+
+После каждого действия стол помечается измененным; через flush_delay секунд все
+измененные столы записываются одной транзакцией. В базу уходит только разница с
+прошлым сохранением (JSON Merge Patch), места игроков хранятся словарем "место -> игрок",
+поэтому ставка одного игрока переписывает только его запись.
+
+С журналом (journal.py) снимок хранит journal_lsn - последнюю учтенную запись журнала;
+при восстановлении записи после нее применяются поверх снимка.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from database import AsyncDatabase
+from journal import Journal
+from poker_engine import GameListener, PokerGame
+
+logger = logging.getLogger(__name__)
+
+
+def hand_results(game: PokerGame) -> list:
+    """Итоги законченной раздачи для Database.settle_hands"""
+    result = game.showdown_result
+    winners = {p.user_id for p in result.winners}
+    return [
+        {
+            "user_id": p.user_id,
+            "chips": p.chips,
+            "won": p.user_id in winners,
+            "winnings": result.payouts.get(p.user_id, 0),
+            "profit": result.payouts.get(p.user_id, 0) - p.total_bet,
+        }
+        for p in game.players
+    ]
+
+
+def to_stored(game: PokerGame) -> dict:
+    """Состояние стола для game_state: snapshot с местами в виде словаря"""
+    state = game.snapshot()
+    state["players"] = {str(seat): player for seat, player in enumerate(state["players"])}
+    return state
+
+
+def from_stored(state: dict) -> PokerGame:
+    players = state["players"]
+    data = dict(state)
+    data["players"] = [players[str(seat)] for seat in range(len(players))]
+    return PokerGame.from_snapshot(data)
+
+
+def state_delta(old: dict, new: dict) -> dict:
+    """Merge Patch, который превращает old в new (None - удалить ключ)"""
+    patch = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = state_delta(previous, value)
+            if nested:
+                patch[key] = nested
+        elif value != previous:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+class TableStore(GameListener):
+    """Отложенная запись столов в базу; один экземпляр слушает все столы"""
+
+    def __init__(self, db: AsyncDatabase, flush_delay: float = 0.5, journal: Optional[Journal] = None):
+        self.db = db
+        self.flush_delay = flush_delay
+        self.journal = journal
+        # game_id -> GameTable.id; game_id стола - это str(GameTable.id), в одном чате столов может быть несколько
+        self.table_ids: Dict[str, int] = {}
+        self._saved: Dict[str, dict] = {}  # последнее записанное состояние
+        self._dirty: Dict[str, PokerGame] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def add(self, game: PokerGame, chat_id: int, creator_id: int) -> int:
+        """Новый стол: строка в game_tables и полная первая запись; game_id стола становится id строки"""
+        table = await self.db.create_table(chat_id, creator_id, game.small_blind, game.big_blind,
+                                           max_players=game.max_players)
+        game.game_id = str(table.id)
+        state = self._state(game)
+        self.db.submit("update_table_state", table.id, state)
+        self._track(game, table.id, state)
+        return table.id
+
+    def _state(self, game: PokerGame) -> dict:
+        state = to_stored(game)
+        if game.showdown_result is not None:
+            # ShowdownResult в снимок не входит - без итогов стол после перезапуска не рассчитать
+            state["results"] = hand_results(game)
+        elif game.stage == "showdown" and "results" in self._saved.get(game.game_id, {}):
+            # Стол восстановлен из снимка после вскрытия
+            state["results"] = self._saved[game.game_id]["results"]
+        if self.journal is not None:
+            # Все записи журнала до этой уже отражены в состоянии стола
+            state["journal_lsn"] = self.journal.last_lsn
+        return state
+
+    def _track(self, game: PokerGame, table_id: int, state: dict):
+        self.table_ids[game.game_id] = table_id
+        self._saved[game.game_id] = state
+        # Журнал - раньше себя: к моменту записи снимка запись действия уже должна получить LSN
+        if self.journal is not None:
+            game.listeners.append(self.journal)
+        game.listeners.append(self)
+
+    def restore(self) -> List[Tuple[int, PokerGame]]:
+        """
+        Все незавершенные столы после перезапуска: [(chat_id, PokerGame)] по порядку создания
+        (вызывать до запуска event loop). Столы, сохраненные после вскрытия, не возвращаются:
+        итоги записываются, стол закрывается
+        """
+        tables = []
+        for table in self.db.submit("get_unfinished_tables").result():
+            try:
+                tables.append((table, from_stored(table.game_state)))
+            except (KeyError, TypeError, ValueError):
+                logger.exception("Не удалось восстановить стол %s", table.id)
+        tables.sort(key=lambda item: item[0].id)
+
+        # Записи журнала ищутся по game_id. Раньше game_id был id чата - такие записи
+        # относим к столу, только если он единственный с этим game_id (иначе - к последнему)
+        legacy = Counter(game.game_id for table, game in tables if game.game_id != str(table.id))
+        recovering = {}
+        renamed = []
+        for table, game in tables:
+            old_id = game.game_id
+            game.game_id = str(table.id)
+            if old_id != game.game_id:
+                renamed.append(game)
+                legacy[old_id] -= 1
+                if legacy[old_id] == 0:
+                    recovering[old_id] = game
+                else:
+                    logger.warning("Стол %s: несколько столов с game_id %s, журнал не применяется", table.id, old_id)
+            recovering[game.game_id] = game
+            self._track(game, table.id, table.game_state)
+
+        applied = 0
+        if self.journal is not None and tables:
+            applied = self.journal.recover({
+                game_id: (game, self._saved[game.game_id].get("journal_lsn", 0))
+                for game_id, game in recovering.items()
+            })
+            logger.info("Из журнала применено записей: %s", applied)
+        if applied:
+            self._dirty.update((game.game_id, game) for _, game in tables)
+        else:
+            self._dirty.update((game.game_id, game) for game in renamed)
+
+        # Раздача закончилась, а итоги не записаны: рассчитываем и закрываем стол
+        games = []
+        for table, game in tables:
+            if game.stage == "showdown":
+                self._settle_restored(game)
+            else:
+                games.append((table.chat_id, game))
+
+        if self._dirty:
+            self.flush()
+        return games
+
+    def _settle_restored(self, game: PokerGame):
+        if game.showdown_result is not None:
+            results = hand_results(game)
+        else:
+            results = self._saved[game.game_id].get("results")
+        if results is None:
+            # Снимок без итогов: возвращаем стеки на балансы без статистики раздачи
+            logger.warning("Стол %s восстановлен после вскрытия без итогов раздачи", game.game_id)
+            self.close(game)
+            return
+        table_id = self.release(game)
+        self.db.submit("settle_hands", [results], [table_id] if table_id is not None else [])
+
+    # ========== События стола ==========
+
+    def on_hand_start(self, game: PokerGame):
+        self.mark_dirty(game)
+
+    def on_action(self, game: PokerGame, seat: int, action: str, amount: int):
+        self.mark_dirty(game)
+
+    def mark_dirty(self, game: PokerGame):
+        """Запомнить стол для записи; несколько действий подряд попадут в одну транзакцию"""
+        if game.game_id not in self.table_ids:
+            return
+        self._dirty[game.game_id] = game
+        if self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Вне event loop (скрипты, тесты) пишем сразу
+                self.flush()
+                return
+            self._timer = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self):
+        """Записать все измененные столы одной транзакцией"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        dirty, self._dirty = self._dirty, {}
+
+        updates = []
+        for game_id, game in dirty.items():
+            state = self._state(game)
+            patch = state_delta(self._saved[game_id], state)
+            if not patch:
+                continue
+            updates.append(self._update(game_id, patch, state))
+            self._saved[game_id] = state
+
+        if self.journal is not None and updates:
+            # Неизмененные столы тоже сдвигают journal_lsn - иначе простаивающий стол
+            # держит на диске весь журнал после своего последнего действия
+            lsn = self.journal.last_lsn
+            for game_id, state in self._saved.items():
+                if game_id not in dirty and state.get("journal_lsn", 0) < lsn:
+                    state["journal_lsn"] = lsn
+                    updates.append(self._update(game_id, {"journal_lsn": lsn}, state))
+
+        if updates:
+            # Запись идет в потоке базы, обработчики ее не ждут
+            future = self.db.submit("patch_table_states", updates)
+            if self.journal is not None:
+                # Записи, учтенные во всех снимках, удаляем только после commit этих снимков
+                lsns = [state.get("journal_lsn", 0) for state in self._saved.values()]
+                keep = min(lsns) if lsns else self.journal.last_lsn
+                future.add_done_callback(lambda f: self._discard_journal(f, keep))
+
+    def _update(self, game_id: str, patch: dict, state: dict) -> dict:
+        return {
+            "table_id": self.table_ids[game_id],
+            "patch": patch,
+            "stage": state["stage"],
+            "pot": state["pot"],
+            "community_cards": state["community_cards"],
+            "status": "waiting" if state["stage"] == "waiting" else "playing",
+        }
+
+    def _discard_journal(self, future, lsn: int):
+        if future.exception() is not None:
+            logger.error("Не удалось записать столы, журнал сохранен", exc_info=future.exception())
+            return
+        self.journal.discard_before(lsn)
+
+    def release(self, game: PokerGame) -> Optional[int]:
+        """
+        Стол закрывается: записываем последнее состояние (с итогами раздачи) и больше не следим
+        Возвращает id строки стола - пометить завершенным его нужно в транзакции с итогами
+        (SettlementBuffer.add), до этого после перезапуска restore() рассчитает стол сам
+        """
+        game_id = game.game_id
+        if game_id in self.table_ids:
+            self._dirty[game_id] = game
+            self.flush()
+        self._saved.pop(game_id, None)
+        for listener in (self, self.journal):
+            if listener in game.listeners:
+                game.listeners.remove(listener)
+        return self.table_ids.pop(game_id, None)
+
+    def close(self, game: PokerGame):
+        """
+        Закрыть стол без расчета раздачи (лишний стол в чате, стол без итогов):
+        стеки вместе со ставками незаконченной раздачи возвращаются на балансы
+        """
+        in_hand = game.stage not in ("waiting", "showdown")
+        stacks = {p.user_id: p.chips + (p.total_bet if in_hand else 0) for p in game.players}
+        table_id = self.release(game)
+        if table_id is not None:
+            self.db.submit("close_table", table_id, stacks)